@@ -20,7 +20,14 @@
 #
 # where TAG is a valid tag name, ex 'DateTimeOriginal'
 #
-# These 2 are useful when you are retrieving a large list of images
+# To only retrieve some tags, pass their names (as they appear in the
+# returned dictionary) as
+#    tags = EXIF.process_file(f, tags=('EXIF DateTimeOriginal',))
+#
+# Only the IFDs leading to those tags are read, and processing stops as
+# soon as all of them are found.
+#
+# These 3 are useful when you are retrieving a large list of images
 #
 #
 # To return an error on invalid tags,
@@ -30,7 +37,10 @@
 # Otherwise these tags will be ignored
 #
 # Returned tags will be a dictionary mapping names of EXIF tags to their
-# values in the file named by path_name.  You can process the tags
+# values in the file named by path_name.  Embedded thumbnails come back as
+# Thumbnail handles, call their read() method to get the image data.  For
+# raw files (NEF, DNG...) the full size JPEG preview found in IFD0 or its
+# SubIFDs is returned the same way as 'JPEGPreview'.  You can process the tags
 # as you wish.  In particular, you can iterate through all the tags with:
 #     for tag in tags.keys():
 #         if tag not in ('JPEGThumbnail', 'TIFFThumbnail', 'Filename',
@@ -80,6 +90,11 @@
 #
 #
 
+import array
+import mmap
+import os
+import struct
+import sys
 
 
 # Don't throw an exception when given an out of range character.
@@ -118,10 +133,39 @@ FIELD_TYPES = (
     (8, 'SR', 'Signed Ratio'),
     )
 
+# struct format of one value of each field type, indexed like FIELD_TYPES
+FIELD_FORMATS = ('', 'B', 's', 'H', 'L', 'LL', 'b', 'B', 'h', 'l', 'll')
+
+# array typecodes for the integer field types, where the platform has one
+# of the right size
+ARRAY_CODES = dict([(field_type, code) for field_type, code in
+                    ((1, 'B'), (3, 'H'), (4, 'I'), (6, 'b'), (7, 'B'),
+                     (8, 'h'), (9, 'i'))
+                    if array.array(code).itemsize == FIELD_TYPES[field_type][0]])
+
+# struct byte order character of this machine
+NATIVE_ORDER = {'little': '<', 'big': '>'}[sys.byteorder]
+
+# struct format of an integer of a given length in bytes
+INT_FORMATS = {1: 'B', 2: 'H', 4: 'L', 8: 'Q'}
+
+# compiled structs of the fixed size formats things are decoded with: an
+# integer, an IFD entry (tag, type, count, value/offset) and a value of
+# each field type, in either byte order
+_structs = dict([(order + fmt, struct.Struct(order + fmt))
+                 for order in '<>'
+                 for fmt in INT_FORMATS.values() +
+                            [fmt.lower() for fmt in INT_FORMATS.values()] +
+                            ['HHLL'] + [fmt for fmt in FIELD_FORMATS if fmt]])
+
+def get_struct(fmt):
+    return _structs[fmt]
+
 # dictionary of main EXIF tag names
 # first element of tuple is tag name, optional second element is
 # another dictionary giving names to values
 EXIF_TAGS = {
+    0x00FE: ('NewSubfileType', ),
     0x0100: ('ImageWidth', ),
     0x0101: ('ImageLength', ),
     0x0102: ('BitsPerSample', ),
@@ -190,6 +234,7 @@ EXIF_TAGS = {
     0x013B: ('Artist', ),
     0x013E: ('WhitePoint', ),
     0x013F: ('PrimaryChromaticities', ),
+    0x014A: ('SubIFDs', ),
     0x0156: ('TransferRange', ),
     0x0200: ('JPEGProc', ),
     0x0201: ('JPEGInterchangeFormat', ),
@@ -412,6 +457,10 @@ GPS_TAGS = {
     0x001D: ('GPSDate', ),
     }
 
+# tags locating the JPEG preview in an IFD
+PREVIEW_TAGS = ('NewSubfileType', 'Compression', 'JPEGInterchangeFormat',
+                'JPEGInterchangeFormatLength', 'StripOffsets', 'StripByteCounts')
+
 # Ignore these tags when quick processing
 # 0x927C is MakerNote Tags
 # 0x9286 is user comment
@@ -465,184 +514,186 @@ def nikon_ev_bias(seq):
     return ret_str
 
 # Nikon E99x MakerNote Tags
-MAKERNOTE_NIKON_NEWER_TAGS={
-    0x0001: ('MakernoteVersion', make_string),	# Sometimes binary
-    0x0002: ('ISOSetting', make_string),
-    0x0003: ('ColorMode', ),
-    0x0004: ('Quality', ),
-    0x0005: ('Whitebalance', ),
-    0x0006: ('ImageSharpening', ),
-    0x0007: ('FocusMode', ),
-    0x0008: ('FlashSetting', ),
-    0x0009: ('AutoFlashMode', ),
-    0x000B: ('WhiteBalanceBias', ),
-    0x000C: ('WhiteBalanceRBCoeff', ),
-    0x000D: ('ProgramShift', nikon_ev_bias),
-    # Nearly the same as the other EV vals, but step size is 1/12 EV (?)
-    0x000E: ('ExposureDifference', nikon_ev_bias),
-    0x000F: ('ISOSelection', ),
-    0x0011: ('NikonPreview', ),
-    0x0012: ('FlashCompensation', nikon_ev_bias),
-    0x0013: ('ISOSpeedRequested', ),
-    0x0016: ('PhotoCornerCoordinates', ),
-    # 0x0017: Unknown, but most likely an EV value
-    0x0018: ('FlashBracketCompensationApplied', nikon_ev_bias),
-    0x0019: ('AEBracketCompensationApplied', ),
-    0x001A: ('ImageProcessing', ),
-    0x001B: ('CropHiSpeed', ),
-    0x001D: ('SerialNumber', ),	# Conflict with 0x00A0 ?
-    0x001E: ('ColorSpace', ),
-    0x001F: ('VRInfo', ),
-    0x0020: ('ImageAuthentication', ),
-    0x0022: ('ActiveDLighting', ),
-    0x0023: ('PictureControl', ),
-    0x0024: ('WorldTime', ),
-    0x0025: ('ISOInfo', ),
-    0x0080: ('ImageAdjustment', ),
-    0x0081: ('ToneCompensation', ),
-    0x0082: ('AuxiliaryLens', ),
-    0x0083: ('LensType', ),
-    0x0084: ('LensMinMaxFocalMaxAperture', ),
-    0x0085: ('ManualFocusDistance', ),
-    0x0086: ('DigitalZoomFactor', ),
-    0x0087: ('FlashMode',
-             {0x00: 'Did Not Fire',
-              0x01: 'Fired, Manual',
-              0x07: 'Fired, External',
-              0x08: 'Fired, Commander Mode ',
-              0x09: 'Fired, TTL Mode'}),
-    0x0088: ('AFFocusPosition',
-             {0x0000: 'Center',
-              0x0100: 'Top',
-              0x0200: 'Bottom',
-              0x0300: 'Left',
-              0x0400: 'Right'}),
-    0x0089: ('BracketingMode',
-             {0x00: 'Single frame, no bracketing',
-              0x01: 'Continuous, no bracketing',
-              0x02: 'Timer, no bracketing',
-              0x10: 'Single frame, exposure bracketing',
-              0x11: 'Continuous, exposure bracketing',
-              0x12: 'Timer, exposure bracketing',
-              0x40: 'Single frame, white balance bracketing',
-              0x41: 'Continuous, white balance bracketing',
-              0x42: 'Timer, white balance bracketing'}),
-    0x008A: ('AutoBracketRelease', ),
-    0x008B: ('LensFStops', ),
-    0x008C: ('NEFCurve1', ),	# ExifTool calls this 'ContrastCurve'
-    0x008D: ('ColorMode', ),
-    0x008F: ('SceneMode', ),
-    0x0090: ('LightingType', ),
-    0x0091: ('ShotInfo', ),	# First 4 bytes are a version number in ASCII
-    0x0092: ('HueAdjustment', ),
-    # ExifTool calls this 'NEFCompression', should be 1-4
-    0x0093: ('Compression', ),
-    0x0094: ('Saturation',
-             {-3: 'B&W',
-              -2: '-2',
-              -1: '-1',
-              0: '0',
-              1: '1',
-              2: '2'}),
-    0x0095: ('NoiseReduction', ),
-    0x0096: ('NEFCurve2', ),	# ExifTool calls this 'LinearizationTable'
-    0x0097: ('ColorBalance', ),	# First 4 bytes are a version number in ASCII
-    0x0098: ('LensData', ),	# First 4 bytes are a version number in ASCII
-    0x0099: ('RawImageCenter', ),
-    0x009A: ('SensorPixelSize', ),
-    0x009C: ('Scene Assist', ),
-    0x009E: ('RetouchHistory', ),
-    0x00A0: ('SerialNumber', ),
-    0x00A2: ('ImageDataSize', ),
-    # 00A3: unknown - a single byte 0
-    # 00A4: In NEF, looks like a 4 byte ASCII version number ('0200')
-    0x00A5: ('ImageCount', ),
-    0x00A6: ('DeletedImageCount', ),
-    0x00A7: ('TotalShutterReleases', ),
-    # First 4 bytes are a version number in ASCII, with version specific
-    # info to follow.  Its hard to treat it as a string due to embedded nulls.
-    0x00A8: ('FlashInfo', ),
-    0x00A9: ('ImageOptimization', ),
-    0x00AA: ('Saturation', ),
-    0x00AB: ('DigitalVariProgram', ),
-    0x00AC: ('ImageStabilization', ),
-    0x00AD: ('Responsive AF', ),	# 'AFResponse'
-    0x00B0: ('MultiExposure', ),
-    0x00B1: ('HighISONoiseReduction', ),
-    0x00B7: ('AFInfo', ),
-    0x00B8: ('FileInfo', ),
-    # 00B9: unknown
-    0x0100: ('DigitalICE', ),
-    0x0103: ('PreviewCompression',
-             {1: 'Uncompressed',
-              2: 'CCITT 1D',
-              3: 'T4/Group 3 Fax',
-              4: 'T6/Group 4 Fax',
-              5: 'LZW',
-              6: 'JPEG (old-style)',
-              7: 'JPEG',
-              8: 'Adobe Deflate',
-              9: 'JBIG B&W',
-              10: 'JBIG Color',
-              32766: 'Next',
-              32769: 'Epson ERF Compressed',
-              32771: 'CCIRLEW',
-              32773: 'PackBits',
-              32809: 'Thunderscan',
-              32895: 'IT8CTPAD',
-              32896: 'IT8LW',
-              32897: 'IT8MP',
-              32898: 'IT8BL',
-              32908: 'PixarFilm',
-              32909: 'PixarLog',
-              32946: 'Deflate',
-              32947: 'DCS',
-              34661: 'JBIG',
-              34676: 'SGILog',
-              34677: 'SGILog24',
-              34712: 'JPEG 2000',
-              34713: 'Nikon NEF Compressed',
-              65000: 'Kodak DCR Compressed',
-              65535: 'Pentax PEF Compressed',}),
-    0x0201: ('PreviewImageStart', ),
-    0x0202: ('PreviewImageLength', ),
-    0x0213: ('PreviewYCbCrPositioning',
-             {1: 'Centered',
-              2: 'Co-sited'}), 
-    0x0010: ('DataDump', ),
-    }
-
-MAKERNOTE_NIKON_OLDER_TAGS = {
-    0x0003: ('Quality',
-             {1: 'VGA Basic',
-              2: 'VGA Normal',
-              3: 'VGA Fine',
-              4: 'SXGA Basic',
-              5: 'SXGA Normal',
-              6: 'SXGA Fine'}),
-    0x0004: ('ColorMode',
-             {1: 'Color',
-              2: 'Monochrome'}),
-    0x0005: ('ImageAdjustment',
-             {0: 'Normal',
-              1: 'Bright+',
-              2: 'Bright-',
-              3: 'Contrast+',
-              4: 'Contrast-'}),
-    0x0006: ('CCDSpeed',
-             {0: 'ISO 80',
-              2: 'ISO 160',
-              4: 'ISO 320',
-              5: 'ISO 100'}),
-    0x0007: ('WhiteBalance',
-             {0: 'Auto',
-              1: 'Preset',
-              2: 'Daylight',
-              3: 'Incandescent',
-              4: 'Fluorescent',
-              5: 'Cloudy',
-              6: 'Speed Light'}),
-    }
+def _nikon_tags():
+    newer = {
+        0x0001: ('MakernoteVersion', make_string),	# Sometimes binary
+        0x0002: ('ISOSetting', make_string),
+        0x0003: ('ColorMode', ),
+        0x0004: ('Quality', ),
+        0x0005: ('Whitebalance', ),
+        0x0006: ('ImageSharpening', ),
+        0x0007: ('FocusMode', ),
+        0x0008: ('FlashSetting', ),
+        0x0009: ('AutoFlashMode', ),
+        0x000B: ('WhiteBalanceBias', ),
+        0x000C: ('WhiteBalanceRBCoeff', ),
+        0x000D: ('ProgramShift', nikon_ev_bias),
+        # Nearly the same as the other EV vals, but step size is 1/12 EV (?)
+        0x000E: ('ExposureDifference', nikon_ev_bias),
+        0x000F: ('ISOSelection', ),
+        0x0011: ('NikonPreview', ),
+        0x0012: ('FlashCompensation', nikon_ev_bias),
+        0x0013: ('ISOSpeedRequested', ),
+        0x0016: ('PhotoCornerCoordinates', ),
+        # 0x0017: Unknown, but most likely an EV value
+        0x0018: ('FlashBracketCompensationApplied', nikon_ev_bias),
+        0x0019: ('AEBracketCompensationApplied', ),
+        0x001A: ('ImageProcessing', ),
+        0x001B: ('CropHiSpeed', ),
+        0x001D: ('SerialNumber', ),	# Conflict with 0x00A0 ?
+        0x001E: ('ColorSpace', ),
+        0x001F: ('VRInfo', ),
+        0x0020: ('ImageAuthentication', ),
+        0x0022: ('ActiveDLighting', ),
+        0x0023: ('PictureControl', ),
+        0x0024: ('WorldTime', ),
+        0x0025: ('ISOInfo', ),
+        0x0080: ('ImageAdjustment', ),
+        0x0081: ('ToneCompensation', ),
+        0x0082: ('AuxiliaryLens', ),
+        0x0083: ('LensType', ),
+        0x0084: ('LensMinMaxFocalMaxAperture', ),
+        0x0085: ('ManualFocusDistance', ),
+        0x0086: ('DigitalZoomFactor', ),
+        0x0087: ('FlashMode',
+                 {0x00: 'Did Not Fire',
+                  0x01: 'Fired, Manual',
+                  0x07: 'Fired, External',
+                  0x08: 'Fired, Commander Mode ',
+                  0x09: 'Fired, TTL Mode'}),
+        0x0088: ('AFFocusPosition',
+                 {0x0000: 'Center',
+                  0x0100: 'Top',
+                  0x0200: 'Bottom',
+                  0x0300: 'Left',
+                  0x0400: 'Right'}),
+        0x0089: ('BracketingMode',
+                 {0x00: 'Single frame, no bracketing',
+                  0x01: 'Continuous, no bracketing',
+                  0x02: 'Timer, no bracketing',
+                  0x10: 'Single frame, exposure bracketing',
+                  0x11: 'Continuous, exposure bracketing',
+                  0x12: 'Timer, exposure bracketing',
+                  0x40: 'Single frame, white balance bracketing',
+                  0x41: 'Continuous, white balance bracketing',
+                  0x42: 'Timer, white balance bracketing'}),
+        0x008A: ('AutoBracketRelease', ),
+        0x008B: ('LensFStops', ),
+        0x008C: ('NEFCurve1', ),	# ExifTool calls this 'ContrastCurve'
+        0x008D: ('ColorMode', ),
+        0x008F: ('SceneMode', ),
+        0x0090: ('LightingType', ),
+        0x0091: ('ShotInfo', ),	# First 4 bytes are a version number in ASCII
+        0x0092: ('HueAdjustment', ),
+        # ExifTool calls this 'NEFCompression', should be 1-4
+        0x0093: ('Compression', ),
+        0x0094: ('Saturation',
+                 {-3: 'B&W',
+                  -2: '-2',
+                  -1: '-1',
+                  0: '0',
+                  1: '1',
+                  2: '2'}),
+        0x0095: ('NoiseReduction', ),
+        0x0096: ('NEFCurve2', ),	# ExifTool calls this 'LinearizationTable'
+        0x0097: ('ColorBalance', ),	# First 4 bytes are a version number in ASCII
+        0x0098: ('LensData', ),	# First 4 bytes are a version number in ASCII
+        0x0099: ('RawImageCenter', ),
+        0x009A: ('SensorPixelSize', ),
+        0x009C: ('Scene Assist', ),
+        0x009E: ('RetouchHistory', ),
+        0x00A0: ('SerialNumber', ),
+        0x00A2: ('ImageDataSize', ),
+        # 00A3: unknown - a single byte 0
+        # 00A4: In NEF, looks like a 4 byte ASCII version number ('0200')
+        0x00A5: ('ImageCount', ),
+        0x00A6: ('DeletedImageCount', ),
+        0x00A7: ('TotalShutterReleases', ),
+        # First 4 bytes are a version number in ASCII, with version specific
+        # info to follow.  Its hard to treat it as a string due to embedded nulls.
+        0x00A8: ('FlashInfo', ),
+        0x00A9: ('ImageOptimization', ),
+        0x00AA: ('Saturation', ),
+        0x00AB: ('DigitalVariProgram', ),
+        0x00AC: ('ImageStabilization', ),
+        0x00AD: ('Responsive AF', ),	# 'AFResponse'
+        0x00B0: ('MultiExposure', ),
+        0x00B1: ('HighISONoiseReduction', ),
+        0x00B7: ('AFInfo', ),
+        0x00B8: ('FileInfo', ),
+        # 00B9: unknown
+        0x0100: ('DigitalICE', ),
+        0x0103: ('PreviewCompression',
+                 {1: 'Uncompressed',
+                  2: 'CCITT 1D',
+                  3: 'T4/Group 3 Fax',
+                  4: 'T6/Group 4 Fax',
+                  5: 'LZW',
+                  6: 'JPEG (old-style)',
+                  7: 'JPEG',
+                  8: 'Adobe Deflate',
+                  9: 'JBIG B&W',
+                  10: 'JBIG Color',
+                  32766: 'Next',
+                  32769: 'Epson ERF Compressed',
+                  32771: 'CCIRLEW',
+                  32773: 'PackBits',
+                  32809: 'Thunderscan',
+                  32895: 'IT8CTPAD',
+                  32896: 'IT8LW',
+                  32897: 'IT8MP',
+                  32898: 'IT8BL',
+                  32908: 'PixarFilm',
+                  32909: 'PixarLog',
+                  32946: 'Deflate',
+                  32947: 'DCS',
+                  34661: 'JBIG',
+                  34676: 'SGILog',
+                  34677: 'SGILog24',
+                  34712: 'JPEG 2000',
+                  34713: 'Nikon NEF Compressed',
+                  65000: 'Kodak DCR Compressed',
+                  65535: 'Pentax PEF Compressed',}),
+        0x0201: ('PreviewImageStart', ),
+        0x0202: ('PreviewImageLength', ),
+        0x0213: ('PreviewYCbCrPositioning',
+                 {1: 'Centered',
+                  2: 'Co-sited'}), 
+        0x0010: ('DataDump', ),
+        }
+
+    older = {
+        0x0003: ('Quality',
+                 {1: 'VGA Basic',
+                  2: 'VGA Normal',
+                  3: 'VGA Fine',
+                  4: 'SXGA Basic',
+                  5: 'SXGA Normal',
+                  6: 'SXGA Fine'}),
+        0x0004: ('ColorMode',
+                 {1: 'Color',
+                  2: 'Monochrome'}),
+        0x0005: ('ImageAdjustment',
+                 {0: 'Normal',
+                  1: 'Bright+',
+                  2: 'Bright-',
+                  3: 'Contrast+',
+                  4: 'Contrast-'}),
+        0x0006: ('CCDSpeed',
+                 {0: 'ISO 80',
+                  2: 'ISO 160',
+                  4: 'ISO 320',
+                  5: 'ISO 100'}),
+        0x0007: ('WhiteBalance',
+                 {0: 'Auto',
+                  1: 'Preset',
+                  2: 'Daylight',
+                  3: 'Incandescent',
+                  4: 'Fluorescent',
+                  5: 'Cloudy',
+                  6: 'Speed Light'}),
+        }
+    return newer, older
 
 # decode Olympus SpecialMode tag in MakerNote
 def olympus_special_mode(v):
@@ -661,512 +712,557 @@ def olympus_special_mode(v):
         return v
     return '%s - sequence %d - %s' % (a[v[0]], v[1], b[v[2]])
 
-MAKERNOTE_OLYMPUS_TAGS={
-    # ah HAH! those sneeeeeaky bastids! this is how they get past the fact
-    # that a JPEG thumbnail is not allowed in an uncompressed TIFF file
-    0x0100: ('JPEGThumbnail', ),
-    0x0200: ('SpecialMode', olympus_special_mode),
-    0x0201: ('JPEGQual',
-             {1: 'SQ',
-              2: 'HQ',
-              3: 'SHQ'}),
-    0x0202: ('Macro',
-             {0: 'Normal',
-             1: 'Macro',
-             2: 'SuperMacro'}),
-    0x0203: ('BWMode',
-             {0: 'Off',
-             1: 'On'}),
-    0x0204: ('DigitalZoom', ),
-    0x0205: ('FocalPlaneDiagonal', ),
-    0x0206: ('LensDistortionParams', ),
-    0x0207: ('SoftwareRelease', ),
-    0x0208: ('PictureInfo', ),
-    0x0209: ('CameraID', make_string), # print as string
-    0x0F00: ('DataDump', ),
-    0x0300: ('PreCaptureFrames', ),
-    0x0404: ('SerialNumber', ),
-    0x1000: ('ShutterSpeedValue', ),
-    0x1001: ('ISOValue', ),
-    0x1002: ('ApertureValue', ),
-    0x1003: ('BrightnessValue', ),
-    0x1004: ('FlashMode', ),
-    0x1004: ('FlashMode',
-       {2: 'On',
-        3: 'Off'}),
-    0x1005: ('FlashDevice',
-       {0: 'None',
-        1: 'Internal',
-        4: 'External',
-        5: 'Internal + External'}),
-    0x1006: ('ExposureCompensation', ),
-    0x1007: ('SensorTemperature', ),
-    0x1008: ('LensTemperature', ),
-    0x100b: ('FocusMode',
-       {0: 'Auto',
-        1: 'Manual'}),
-    0x1017: ('RedBalance', ),
-    0x1018: ('BlueBalance', ),
-    0x101a: ('SerialNumber', ),
-    0x1023: ('FlashExposureComp', ),
-    0x1026: ('ExternalFlashBounce',
-       {0: 'No',
-        1: 'Yes'}),
-    0x1027: ('ExternalFlashZoom', ),
-    0x1028: ('ExternalFlashMode', ),
-    0x1029: ('Contrast 	int16u',
-       {0: 'High',
-        1: 'Normal',
-        2: 'Low'}),
-    0x102a: ('SharpnessFactor', ),
-    0x102b: ('ColorControl', ),
-    0x102c: ('ValidBits', ),
-    0x102d: ('CoringFilter', ),
-    0x102e: ('OlympusImageWidth', ),
-    0x102f: ('OlympusImageHeight', ),
-    0x1034: ('CompressionRatio', ),
-    0x1035: ('PreviewImageValid',
-       {0: 'No',
-        1: 'Yes'}),
-    0x1036: ('PreviewImageStart', ),
-    0x1037: ('PreviewImageLength', ),
-    0x1039: ('CCDScanMode',
-       {0: 'Interlaced',
-        1: 'Progressive'}),
-    0x103a: ('NoiseReduction',
-       {0: 'Off',
-        1: 'On'}),
-    0x103b: ('InfinityLensStep', ),
-    0x103c: ('NearLensStep', ),
-
-    # TODO - these need extra definitions
-    # http://search.cpan.org/src/EXIFTOOL/Image-ExifTool-6.90/html/TagNames/Olympus.html
-    0x2010: ('Equipment', ),
-    0x2020: ('CameraSettings', ),
-    0x2030: ('RawDevelopment', ),
-    0x2040: ('ImageProcessing', ),
-    0x2050: ('FocusInfo', ),
-    0x3000: ('RawInfo ', ),
-    }
-
-# 0x2020 CameraSettings
-MAKERNOTE_OLYMPUS_TAG_0x2020={
-    0x0100: ('PreviewImageValid',
-             {0: 'No',
-              1: 'Yes'}),
-    0x0101: ('PreviewImageStart', ),
-    0x0102: ('PreviewImageLength', ),
-    0x0200: ('ExposureMode',
-             {1: 'Manual',
-              2: 'Program',
-              3: 'Aperture-priority AE',
-              4: 'Shutter speed priority AE',
-              5: 'Program-shift'}),
-    0x0201: ('AELock',
-             {0: 'Off',
-              1: 'On'}),
-    0x0202: ('MeteringMode',
-             {2: 'Center Weighted',
-              3: 'Spot',
-              5: 'ESP',
-              261: 'Pattern+AF',
-              515: 'Spot+Highlight control',
-              1027: 'Spot+Shadow control'}),
-    0x0300: ('MacroMode',
-             {0: 'Off',
-              1: 'On'}),
-    0x0301: ('FocusMode',
-             {0: 'Single AF',
-              1: 'Sequential shooting AF',
-              2: 'Continuous AF',
-              3: 'Multi AF',
-              10: 'MF'}),
-    0x0302: ('FocusProcess',
-             {0: 'AF Not Used',
-              1: 'AF Used'}),
-    0x0303: ('AFSearch',
-             {0: 'Not Ready',
-              1: 'Ready'}),
-    0x0304: ('AFAreas', ),
-    0x0401: ('FlashExposureCompensation', ),
-    0x0500: ('WhiteBalance2',
-             {0: 'Auto',
-             16: '7500K (Fine Weather with Shade)',
-             17: '6000K (Cloudy)',
-             18: '5300K (Fine Weather)',
-             20: '3000K (Tungsten light)',
-             21: '3600K (Tungsten light-like)',
-             33: '6600K (Daylight fluorescent)',
-             34: '4500K (Neutral white fluorescent)',
-             35: '4000K (Cool white fluorescent)',
-             48: '3600K (Tungsten light-like)',
-             256: 'Custom WB 1',
-             257: 'Custom WB 2',
-             258: 'Custom WB 3',
-             259: 'Custom WB 4',
-             512: 'Custom WB 5400K',
-             513: 'Custom WB 2900K',
-             514: 'Custom WB 8000K', }),
-    0x0501: ('WhiteBalanceTemperature', ),
-    0x0502: ('WhiteBalanceBracket', ),
-    0x0503: ('CustomSaturation', ), # (3 numbers: 1. CS Value, 2. Min, 3. Max)
-    0x0504: ('ModifiedSaturation',
-             {0: 'Off',
-              1: 'CM1 (Red Enhance)',
-              2: 'CM2 (Green Enhance)',
-              3: 'CM3 (Blue Enhance)',
-              4: 'CM4 (Skin Tones)'}),
-    0x0505: ('ContrastSetting', ), # (3 numbers: 1. Contrast, 2. Min, 3. Max)
-    0x0506: ('SharpnessSetting', ), # (3 numbers: 1. Sharpness, 2. Min, 3. Max)
-    0x0507: ('ColorSpace',
-             {0: 'sRGB',
-              1: 'Adobe RGB',
-              2: 'Pro Photo RGB'}),
-    0x0509: ('SceneMode',
-             {0: 'Standard',
-              6: 'Auto',
-              7: 'Sport',
-              8: 'Portrait',
-              9: 'Landscape+Portrait',
-             10: 'Landscape',
-             11: 'Night scene',
-             13: 'Panorama',
-             16: 'Landscape+Portrait',
-             17: 'Night+Portrait',
-             19: 'Fireworks',
-             20: 'Sunset',
-             22: 'Macro',
-             25: 'Documents',
-             26: 'Museum',
-             28: 'Beach&Snow',
-             30: 'Candle',
-             35: 'Underwater Wide1',
-             36: 'Underwater Macro',
-             39: 'High Key',
-             40: 'Digital Image Stabilization',
-             44: 'Underwater Wide2',
-             45: 'Low Key',
-             46: 'Children',
-             48: 'Nature Macro'}),
-    0x050a: ('NoiseReduction',
-             {0: 'Off',
-              1: 'Noise Reduction',
-              2: 'Noise Filter',
-              3: 'Noise Reduction + Noise Filter',
-              4: 'Noise Filter (ISO Boost)',
-              5: 'Noise Reduction + Noise Filter (ISO Boost)'}),
-    0x050b: ('DistortionCorrection',
-             {0: 'Off',
-              1: 'On'}),
-    0x050c: ('ShadingCompensation',
-             {0: 'Off',
-              1: 'On'}),
-    0x050d: ('CompressionFactor', ),
-    0x050f: ('Gradation',
-             {'-1 -1 1': 'Low Key',
-              '0 -1 1': 'Normal',
-              '1 -1 1': 'High Key'}),
-    0x0520: ('PictureMode',
-             {1: 'Vivid',
-              2: 'Natural',
-              3: 'Muted',
-              256: 'Monotone',
-              512: 'Sepia'}),
-    0x0521: ('PictureModeSaturation', ),
-    0x0522: ('PictureModeHue?', ),
-    0x0523: ('PictureModeContrast', ),
-    0x0524: ('PictureModeSharpness', ),
-    0x0525: ('PictureModeBWFilter',
-             {0: 'n/a',
-              1: 'Neutral',
-              2: 'Yellow',
-              3: 'Orange',
-              4: 'Red',
-              5: 'Green'}),
-    0x0526: ('PictureModeTone',
-             {0: 'n/a',
-              1: 'Neutral',
-              2: 'Sepia',
-              3: 'Blue',
-              4: 'Purple',
-              5: 'Green'}),
-    0x0600: ('Sequence', ), # 2 or 3 numbers: 1. Mode, 2. Shot number, 3. Mode bits
-    0x0601: ('PanoramaMode', ), # (2 numbers: 1. Mode, 2. Shot number)
-    0x0603: ('ImageQuality2',
-             {1: 'SQ',
-              2: 'HQ',
-              3: 'SHQ',
-              4: 'RAW'}),
-    0x0901: ('ManometerReading', ),
-    }
-
-
-MAKERNOTE_CASIO_TAGS={
-    0x0001: ('RecordingMode',
-             {1: 'Single Shutter',
-              2: 'Panorama',
-              3: 'Night Scene',
-              4: 'Portrait',
-              5: 'Landscape'}),
-    0x0002: ('Quality',
-             {1: 'Economy',
-              2: 'Normal',
-              3: 'Fine'}),
-    0x0003: ('FocusingMode',
-             {2: 'Macro',
-              3: 'Auto Focus',
-              4: 'Manual Focus',
-              5: 'Infinity'}),
-    0x0004: ('FlashMode',
-             {1: 'Auto',
-              2: 'On',
-              3: 'Off',
-              4: 'Red Eye Reduction'}),
-    0x0005: ('FlashIntensity',
-             {11: 'Weak',
-              13: 'Normal',
-              15: 'Strong'}),
-    0x0006: ('Object Distance', ),
-    0x0007: ('WhiteBalance',
-             {1: 'Auto',
-              2: 'Tungsten',
-              3: 'Daylight',
-              4: 'Fluorescent',
-              5: 'Shade',
-              129: 'Manual'}),
-    0x000B: ('Sharpness',
-             {0: 'Normal',
-              1: 'Soft',
-              2: 'Hard'}),
-    0x000C: ('Contrast',
-             {0: 'Normal',
-              1: 'Low',
-              2: 'High'}),
-    0x000D: ('Saturation',
-             {0: 'Normal',
-              1: 'Low',
-              2: 'High'}),
-    0x0014: ('CCDSpeed',
-             {64: 'Normal',
-              80: 'Normal',
-              100: 'High',
-              125: '+1.0',
-              244: '+3.0',
-              250: '+2.0'}),
-    }
-
-MAKERNOTE_FUJIFILM_TAGS={
-    0x0000: ('NoteVersion', make_string),
-    0x1000: ('Quality', ),
-    0x1001: ('Sharpness',
-             {1: 'Soft',
-              2: 'Soft',
-              3: 'Normal',
-              4: 'Hard',
-              5: 'Hard'}),
-    0x1002: ('WhiteBalance',
-             {0: 'Auto',
-              256: 'Daylight',
-              512: 'Cloudy',
-              768: 'DaylightColor-Fluorescent',
-              769: 'DaywhiteColor-Fluorescent',
-              770: 'White-Fluorescent',
-              1024: 'Incandescent',
-              3840: 'Custom'}),
-    0x1003: ('Color',
-             {0: 'Normal',
-              256: 'High',
-              512: 'Low'}),
-    0x1004: ('Tone',
-             {0: 'Normal',
-              256: 'High',
-              512: 'Low'}),
-    0x1010: ('FlashMode',
-             {0: 'Auto',
-              1: 'On',
-              2: 'Off',
-              3: 'Red Eye Reduction'}),
-    0x1011: ('FlashStrength', ),
-    0x1020: ('Macro',
-             {0: 'Off',
-              1: 'On'}),
-    0x1021: ('FocusMode',
-             {0: 'Auto',
-              1: 'Manual'}),
-    0x1030: ('SlowSync',
-             {0: 'Off',
-              1: 'On'}),
-    0x1031: ('PictureMode',
-             {0: 'Auto',
-              1: 'Portrait',
+def _olympus_tags():
+    tags = {
+        # ah HAH! those sneeeeeaky bastids! this is how they get past the fact
+        # that a JPEG thumbnail is not allowed in an uncompressed TIFF file
+        0x0100: ('JPEGThumbnail', ),
+        0x0200: ('SpecialMode', olympus_special_mode),
+        0x0201: ('JPEGQual',
+                 {1: 'SQ',
+                  2: 'HQ',
+                  3: 'SHQ'}),
+        0x0202: ('Macro',
+                 {0: 'Normal',
+                 1: 'Macro',
+                 2: 'SuperMacro'}),
+        0x0203: ('BWMode',
+                 {0: 'Off',
+                 1: 'On'}),
+        0x0204: ('DigitalZoom', ),
+        0x0205: ('FocalPlaneDiagonal', ),
+        0x0206: ('LensDistortionParams', ),
+        0x0207: ('SoftwareRelease', ),
+        0x0208: ('PictureInfo', ),
+        0x0209: ('CameraID', make_string), # print as string
+        0x0F00: ('DataDump', ),
+        0x0300: ('PreCaptureFrames', ),
+        0x0404: ('SerialNumber', ),
+        0x1000: ('ShutterSpeedValue', ),
+        0x1001: ('ISOValue', ),
+        0x1002: ('ApertureValue', ),
+        0x1003: ('BrightnessValue', ),
+        0x1004: ('FlashMode', ),
+        0x1004: ('FlashMode',
+           {2: 'On',
+            3: 'Off'}),
+        0x1005: ('FlashDevice',
+           {0: 'None',
+            1: 'Internal',
+            4: 'External',
+            5: 'Internal + External'}),
+        0x1006: ('ExposureCompensation', ),
+        0x1007: ('SensorTemperature', ),
+        0x1008: ('LensTemperature', ),
+        0x100b: ('FocusMode',
+           {0: 'Auto',
+            1: 'Manual'}),
+        0x1017: ('RedBalance', ),
+        0x1018: ('BlueBalance', ),
+        0x101a: ('SerialNumber', ),
+        0x1023: ('FlashExposureComp', ),
+        0x1026: ('ExternalFlashBounce',
+           {0: 'No',
+            1: 'Yes'}),
+        0x1027: ('ExternalFlashZoom', ),
+        0x1028: ('ExternalFlashMode', ),
+        0x1029: ('Contrast 	int16u',
+           {0: 'High',
+            1: 'Normal',
+            2: 'Low'}),
+        0x102a: ('SharpnessFactor', ),
+        0x102b: ('ColorControl', ),
+        0x102c: ('ValidBits', ),
+        0x102d: ('CoringFilter', ),
+        0x102e: ('OlympusImageWidth', ),
+        0x102f: ('OlympusImageHeight', ),
+        0x1034: ('CompressionRatio', ),
+        0x1035: ('PreviewImageValid',
+           {0: 'No',
+            1: 'Yes'}),
+        0x1036: ('PreviewImageStart', ),
+        0x1037: ('PreviewImageLength', ),
+        0x1039: ('CCDScanMode',
+           {0: 'Interlaced',
+            1: 'Progressive'}),
+        0x103a: ('NoiseReduction',
+           {0: 'Off',
+            1: 'On'}),
+        0x103b: ('InfinityLensStep', ),
+        0x103c: ('NearLensStep', ),
+
+        # TODO - these need extra definitions
+        # http://search.cpan.org/src/EXIFTOOL/Image-ExifTool-6.90/html/TagNames/Olympus.html
+        0x2010: ('Equipment', ),
+        0x2020: ('CameraSettings', ),
+        0x2030: ('RawDevelopment', ),
+        0x2040: ('ImageProcessing', ),
+        0x2050: ('FocusInfo', ),
+        0x3000: ('RawInfo ', ),
+        }
+
+    # 0x2020 CameraSettings
+    tag_0x2020 = {
+        0x0100: ('PreviewImageValid',
+                 {0: 'No',
+                  1: 'Yes'}),
+        0x0101: ('PreviewImageStart', ),
+        0x0102: ('PreviewImageLength', ),
+        0x0200: ('ExposureMode',
+                 {1: 'Manual',
+                  2: 'Program',
+                  3: 'Aperture-priority AE',
+                  4: 'Shutter speed priority AE',
+                  5: 'Program-shift'}),
+        0x0201: ('AELock',
+                 {0: 'Off',
+                  1: 'On'}),
+        0x0202: ('MeteringMode',
+                 {2: 'Center Weighted',
+                  3: 'Spot',
+                  5: 'ESP',
+                  261: 'Pattern+AF',
+                  515: 'Spot+Highlight control',
+                  1027: 'Spot+Shadow control'}),
+        0x0300: ('MacroMode',
+                 {0: 'Off',
+                  1: 'On'}),
+        0x0301: ('FocusMode',
+                 {0: 'Single AF',
+                  1: 'Sequential shooting AF',
+                  2: 'Continuous AF',
+                  3: 'Multi AF',
+                  10: 'MF'}),
+        0x0302: ('FocusProcess',
+                 {0: 'AF Not Used',
+                  1: 'AF Used'}),
+        0x0303: ('AFSearch',
+                 {0: 'Not Ready',
+                  1: 'Ready'}),
+        0x0304: ('AFAreas', ),
+        0x0401: ('FlashExposureCompensation', ),
+        0x0500: ('WhiteBalance2',
+                 {0: 'Auto',
+                 16: '7500K (Fine Weather with Shade)',
+                 17: '6000K (Cloudy)',
+                 18: '5300K (Fine Weather)',
+                 20: '3000K (Tungsten light)',
+                 21: '3600K (Tungsten light-like)',
+                 33: '6600K (Daylight fluorescent)',
+                 34: '4500K (Neutral white fluorescent)',
+                 35: '4000K (Cool white fluorescent)',
+                 48: '3600K (Tungsten light-like)',
+                 256: 'Custom WB 1',
+                 257: 'Custom WB 2',
+                 258: 'Custom WB 3',
+                 259: 'Custom WB 4',
+                 512: 'Custom WB 5400K',
+                 513: 'Custom WB 2900K',
+                 514: 'Custom WB 8000K', }),
+        0x0501: ('WhiteBalanceTemperature', ),
+        0x0502: ('WhiteBalanceBracket', ),
+        0x0503: ('CustomSaturation', ), # (3 numbers: 1. CS Value, 2. Min, 3. Max)
+        0x0504: ('ModifiedSaturation',
+                 {0: 'Off',
+                  1: 'CM1 (Red Enhance)',
+                  2: 'CM2 (Green Enhance)',
+                  3: 'CM3 (Blue Enhance)',
+                  4: 'CM4 (Skin Tones)'}),
+        0x0505: ('ContrastSetting', ), # (3 numbers: 1. Contrast, 2. Min, 3. Max)
+        0x0506: ('SharpnessSetting', ), # (3 numbers: 1. Sharpness, 2. Min, 3. Max)
+        0x0507: ('ColorSpace',
+                 {0: 'sRGB',
+                  1: 'Adobe RGB',
+                  2: 'Pro Photo RGB'}),
+        0x0509: ('SceneMode',
+                 {0: 'Standard',
+                  6: 'Auto',
+                  7: 'Sport',
+                  8: 'Portrait',
+                  9: 'Landscape+Portrait',
+                 10: 'Landscape',
+                 11: 'Night scene',
+                 13: 'Panorama',
+                 16: 'Landscape+Portrait',
+                 17: 'Night+Portrait',
+                 19: 'Fireworks',
+                 20: 'Sunset',
+                 22: 'Macro',
+                 25: 'Documents',
+                 26: 'Museum',
+                 28: 'Beach&Snow',
+                 30: 'Candle',
+                 35: 'Underwater Wide1',
+                 36: 'Underwater Macro',
+                 39: 'High Key',
+                 40: 'Digital Image Stabilization',
+                 44: 'Underwater Wide2',
+                 45: 'Low Key',
+                 46: 'Children',
+                 48: 'Nature Macro'}),
+        0x050a: ('NoiseReduction',
+                 {0: 'Off',
+                  1: 'Noise Reduction',
+                  2: 'Noise Filter',
+                  3: 'Noise Reduction + Noise Filter',
+                  4: 'Noise Filter (ISO Boost)',
+                  5: 'Noise Reduction + Noise Filter (ISO Boost)'}),
+        0x050b: ('DistortionCorrection',
+                 {0: 'Off',
+                  1: 'On'}),
+        0x050c: ('ShadingCompensation',
+                 {0: 'Off',
+                  1: 'On'}),
+        0x050d: ('CompressionFactor', ),
+        0x050f: ('Gradation',
+                 {'-1 -1 1': 'Low Key',
+                  '0 -1 1': 'Normal',
+                  '1 -1 1': 'High Key'}),
+        0x0520: ('PictureMode',
+                 {1: 'Vivid',
+                  2: 'Natural',
+                  3: 'Muted',
+                  256: 'Monotone',
+                  512: 'Sepia'}),
+        0x0521: ('PictureModeSaturation', ),
+        0x0522: ('PictureModeHue?', ),
+        0x0523: ('PictureModeContrast', ),
+        0x0524: ('PictureModeSharpness', ),
+        0x0525: ('PictureModeBWFilter',
+                 {0: 'n/a',
+                  1: 'Neutral',
+                  2: 'Yellow',
+                  3: 'Orange',
+                  4: 'Red',
+                  5: 'Green'}),
+        0x0526: ('PictureModeTone',
+                 {0: 'n/a',
+                  1: 'Neutral',
+                  2: 'Sepia',
+                  3: 'Blue',
+                  4: 'Purple',
+                  5: 'Green'}),
+        0x0600: ('Sequence', ), # 2 or 3 numbers: 1. Mode, 2. Shot number, 3. Mode bits
+        0x0601: ('PanoramaMode', ), # (2 numbers: 1. Mode, 2. Shot number)
+        0x0603: ('ImageQuality2',
+                 {1: 'SQ',
+                  2: 'HQ',
+                  3: 'SHQ',
+                  4: 'RAW'}),
+        0x0901: ('ManometerReading', ),
+        }
+    return tags, tag_0x2020
+
+
+def _casio_tags():
+    tags = {
+        0x0001: ('RecordingMode',
+                 {1: 'Single Shutter',
+                  2: 'Panorama',
+                  3: 'Night Scene',
+                  4: 'Portrait',
+                  5: 'Landscape'}),
+        0x0002: ('Quality',
+                 {1: 'Economy',
+                  2: 'Normal',
+                  3: 'Fine'}),
+        0x0003: ('FocusingMode',
+                 {2: 'Macro',
+                  3: 'Auto Focus',
+                  4: 'Manual Focus',
+                  5: 'Infinity'}),
+        0x0004: ('FlashMode',
+                 {1: 'Auto',
+                  2: 'On',
+                  3: 'Off',
+                  4: 'Red Eye Reduction'}),
+        0x0005: ('FlashIntensity',
+                 {11: 'Weak',
+                  13: 'Normal',
+                  15: 'Strong'}),
+        0x0006: ('Object Distance', ),
+        0x0007: ('WhiteBalance',
+                 {1: 'Auto',
+                  2: 'Tungsten',
+                  3: 'Daylight',
+                  4: 'Fluorescent',
+                  5: 'Shade',
+                  129: 'Manual'}),
+        0x000B: ('Sharpness',
+                 {0: 'Normal',
+                  1: 'Soft',
+                  2: 'Hard'}),
+        0x000C: ('Contrast',
+                 {0: 'Normal',
+                  1: 'Low',
+                  2: 'High'}),
+        0x000D: ('Saturation',
+                 {0: 'Normal',
+                  1: 'Low',
+                  2: 'High'}),
+        0x0014: ('CCDSpeed',
+                 {64: 'Normal',
+                  80: 'Normal',
+                  100: 'High',
+                  125: '+1.0',
+                  244: '+3.0',
+                  250: '+2.0'}),
+        }
+    return tags
+
+def _fujifilm_tags():
+    tags = {
+        0x0000: ('NoteVersion', make_string),
+        0x1000: ('Quality', ),
+        0x1001: ('Sharpness',
+                 {1: 'Soft',
+                  2: 'Soft',
+                  3: 'Normal',
+                  4: 'Hard',
+                  5: 'Hard'}),
+        0x1002: ('WhiteBalance',
+                 {0: 'Auto',
+                  256: 'Daylight',
+                  512: 'Cloudy',
+                  768: 'DaylightColor-Fluorescent',
+                  769: 'DaywhiteColor-Fluorescent',
+                  770: 'White-Fluorescent',
+                  1024: 'Incandescent',
+                  3840: 'Custom'}),
+        0x1003: ('Color',
+                 {0: 'Normal',
+                  256: 'High',
+                  512: 'Low'}),
+        0x1004: ('Tone',
+                 {0: 'Normal',
+                  256: 'High',
+                  512: 'Low'}),
+        0x1010: ('FlashMode',
+                 {0: 'Auto',
+                  1: 'On',
+                  2: 'Off',
+                  3: 'Red Eye Reduction'}),
+        0x1011: ('FlashStrength', ),
+        0x1020: ('Macro',
+                 {0: 'Off',
+                  1: 'On'}),
+        0x1021: ('FocusMode',
+                 {0: 'Auto',
+                  1: 'Manual'}),
+        0x1030: ('SlowSync',
+                 {0: 'Off',
+                  1: 'On'}),
+        0x1031: ('PictureMode',
+                 {0: 'Auto',
+                  1: 'Portrait',
+                  2: 'Landscape',
+                  4: 'Sports',
+                  5: 'Night',
+                  6: 'Program AE',
+                  256: 'Aperture Priority AE',
+                  512: 'Shutter Priority AE',
+                  768: 'Manual Exposure'}),
+        0x1100: ('MotorOrBracket',
+                 {0: 'Off',
+                  1: 'On'}),
+        0x1300: ('BlurWarning',
+                 {0: 'Off',
+                  1: 'On'}),
+        0x1301: ('FocusWarning',
+                 {0: 'Off',
+                  1: 'On'}),
+        0x1302: ('AEWarning',
+                 {0: 'Off',
+                  1: 'On'}),
+        }
+    return tags
+
+def _canon_tags():
+    tags = {
+        0x0006: ('ImageType', ),
+        0x0007: ('FirmwareVersion', ),
+        0x0008: ('ImageNumber', ),
+        0x0009: ('OwnerName', ),
+        }
+
+    # this is in element offset, name, optional value dictionary format
+    tag_0x001 = {
+        1: ('Macromode',
+            {1: 'Macro',
+             2: 'Normal'}),
+        2: ('SelfTimer', ),
+        3: ('Quality',
+            {2: 'Normal',
+             3: 'Fine',
+             5: 'Superfine'}),
+        4: ('FlashMode',
+            {0: 'Flash Not Fired',
+             1: 'Auto',
+             2: 'On',
+             3: 'Red-Eye Reduction',
+             4: 'Slow Synchro',
+             5: 'Auto + Red-Eye Reduction',
+             6: 'On + Red-Eye Reduction',
+             16: 'external flash'}),
+        5: ('ContinuousDriveMode',
+            {0: 'Single Or Timer',
+             1: 'Continuous'}),
+        7: ('FocusMode',
+            {0: 'One-Shot',
+             1: 'AI Servo',
+             2: 'AI Focus',
+             3: 'MF',
+             4: 'Single',
+             5: 'Continuous',
+             6: 'MF'}),
+        10: ('ImageSize',
+             {0: 'Large',
+              1: 'Medium',
+              2: 'Small'}),
+        11: ('EasyShootingMode',
+             {0: 'Full Auto',
+              1: 'Manual',
               2: 'Landscape',
-              4: 'Sports',
+              3: 'Fast Shutter',
+              4: 'Slow Shutter',
               5: 'Night',
-              6: 'Program AE',
-              256: 'Aperture Priority AE',
-              512: 'Shutter Priority AE',
-              768: 'Manual Exposure'}),
-    0x1100: ('MotorOrBracket',
-             {0: 'Off',
-              1: 'On'}),
-    0x1300: ('BlurWarning',
-             {0: 'Off',
-              1: 'On'}),
-    0x1301: ('FocusWarning',
-             {0: 'Off',
-              1: 'On'}),
-    0x1302: ('AEWarning',
-             {0: 'Off',
-              1: 'On'}),
+              6: 'B&W',
+              7: 'Sepia',
+              8: 'Portrait',
+              9: 'Sports',
+              10: 'Macro/Close-Up',
+              11: 'Pan Focus'}),
+        12: ('DigitalZoom',
+             {0: 'None',
+              1: '2x',
+              2: '4x'}),
+        13: ('Contrast',
+             {0xFFFF: 'Low',
+              0: 'Normal',
+              1: 'High'}),
+        14: ('Saturation',
+             {0xFFFF: 'Low',
+              0: 'Normal',
+              1: 'High'}),
+        15: ('Sharpness',
+             {0xFFFF: 'Low',
+              0: 'Normal',
+              1: 'High'}),
+        16: ('ISO',
+             {0: 'See ISOSpeedRatings Tag',
+              15: 'Auto',
+              16: '50',
+              17: '100',
+              18: '200',
+              19: '400'}),
+        17: ('MeteringMode',
+             {3: 'Evaluative',
+              4: 'Partial',
+              5: 'Center-weighted'}),
+        18: ('FocusType',
+             {0: 'Manual',
+              1: 'Auto',
+              3: 'Close-Up (Macro)',
+              8: 'Locked (Pan Mode)'}),
+        19: ('AFPointSelected',
+             {0x3000: 'None (MF)',
+              0x3001: 'Auto-Selected',
+              0x3002: 'Right',
+              0x3003: 'Center',
+              0x3004: 'Left'}),
+        20: ('ExposureMode',
+             {0: 'Easy Shooting',
+              1: 'Program',
+              2: 'Tv-priority',
+              3: 'Av-priority',
+              4: 'Manual',
+              5: 'A-DEP'}),
+        23: ('LongFocalLengthOfLensInFocalUnits', ),
+        24: ('ShortFocalLengthOfLensInFocalUnits', ),
+        25: ('FocalUnitsPerMM', ),
+        28: ('FlashActivity',
+             {0: 'Did Not Fire',
+              1: 'Fired'}),
+        29: ('FlashDetails',
+             {14: 'External E-TTL',
+              13: 'Internal Flash',
+              11: 'FP Sync Used',
+              7: '2nd("Rear")-Curtain Sync Used',
+              4: 'FP Sync Enabled'}),
+        32: ('FocusMode',
+             {0: 'Single',
+              1: 'Continuous'}),
+        }
+
+    tag_0x004 = {
+        7: ('WhiteBalance',
+            {0: 'Auto',
+             1: 'Sunny',
+             2: 'Cloudy',
+             3: 'Tungsten',
+             4: 'Fluorescent',
+             5: 'Flash',
+             6: 'Custom'}),
+        9: ('SequenceNumber', ),
+        14: ('AFPointUsed', ),
+        15: ('FlashBias',
+             {0xFFC0: '-2 EV',
+              0xFFCC: '-1.67 EV',
+              0xFFD0: '-1.50 EV',
+              0xFFD4: '-1.33 EV',
+              0xFFE0: '-1 EV',
+              0xFFEC: '-0.67 EV',
+              0xFFF0: '-0.50 EV',
+              0xFFF4: '-0.33 EV',
+              0x0000: '0 EV',
+              0x000C: '0.33 EV',
+              0x0010: '0.50 EV',
+              0x0014: '0.67 EV',
+              0x0020: '1 EV',
+              0x002C: '1.33 EV',
+              0x0030: '1.50 EV',
+              0x0034: '1.67 EV',
+              0x0040: '2 EV'}),
+        19: ('SubjectDistance', ),
+        }
+    return tags, tag_0x001, tag_0x004
+
+# builders of the MakerNote tag tables of each vendor; most runs only meet
+# one or two vendors, so the tables are built on first use
+MAKERNOTE_BUILDERS = {
+    'nikon': _nikon_tags,
+    'olympus': _olympus_tags,
+    'casio': _casio_tags,
+    'fujifilm': _fujifilm_tags,
+    'canon': _canon_tags,
     }
 
-MAKERNOTE_CANON_TAGS = {
-    0x0006: ('ImageType', ),
-    0x0007: ('FirmwareVersion', ),
-    0x0008: ('ImageNumber', ),
-    0x0009: ('OwnerName', ),
-    }
+# built MakerNote tag tables, by vendor
+_makernote_tags = {}
 
-# this is in element offset, name, optional value dictionary format
-MAKERNOTE_CANON_TAG_0x001 = {
-    1: ('Macromode',
-        {1: 'Macro',
-         2: 'Normal'}),
-    2: ('SelfTimer', ),
-    3: ('Quality',
-        {2: 'Normal',
-         3: 'Fine',
-         5: 'Superfine'}),
-    4: ('FlashMode',
-        {0: 'Flash Not Fired',
-         1: 'Auto',
-         2: 'On',
-         3: 'Red-Eye Reduction',
-         4: 'Slow Synchro',
-         5: 'Auto + Red-Eye Reduction',
-         6: 'On + Red-Eye Reduction',
-         16: 'external flash'}),
-    5: ('ContinuousDriveMode',
-        {0: 'Single Or Timer',
-         1: 'Continuous'}),
-    7: ('FocusMode',
-        {0: 'One-Shot',
-         1: 'AI Servo',
-         2: 'AI Focus',
-         3: 'MF',
-         4: 'Single',
-         5: 'Continuous',
-         6: 'MF'}),
-    10: ('ImageSize',
-         {0: 'Large',
-          1: 'Medium',
-          2: 'Small'}),
-    11: ('EasyShootingMode',
-         {0: 'Full Auto',
-          1: 'Manual',
-          2: 'Landscape',
-          3: 'Fast Shutter',
-          4: 'Slow Shutter',
-          5: 'Night',
-          6: 'B&W',
-          7: 'Sepia',
-          8: 'Portrait',
-          9: 'Sports',
-          10: 'Macro/Close-Up',
-          11: 'Pan Focus'}),
-    12: ('DigitalZoom',
-         {0: 'None',
-          1: '2x',
-          2: '4x'}),
-    13: ('Contrast',
-         {0xFFFF: 'Low',
-          0: 'Normal',
-          1: 'High'}),
-    14: ('Saturation',
-         {0xFFFF: 'Low',
-          0: 'Normal',
-          1: 'High'}),
-    15: ('Sharpness',
-         {0xFFFF: 'Low',
-          0: 'Normal',
-          1: 'High'}),
-    16: ('ISO',
-         {0: 'See ISOSpeedRatings Tag',
-          15: 'Auto',
-          16: '50',
-          17: '100',
-          18: '200',
-          19: '400'}),
-    17: ('MeteringMode',
-         {3: 'Evaluative',
-          4: 'Partial',
-          5: 'Center-weighted'}),
-    18: ('FocusType',
-         {0: 'Manual',
-          1: 'Auto',
-          3: 'Close-Up (Macro)',
-          8: 'Locked (Pan Mode)'}),
-    19: ('AFPointSelected',
-         {0x3000: 'None (MF)',
-          0x3001: 'Auto-Selected',
-          0x3002: 'Right',
-          0x3003: 'Center',
-          0x3004: 'Left'}),
-    20: ('ExposureMode',
-         {0: 'Easy Shooting',
-          1: 'Program',
-          2: 'Tv-priority',
-          3: 'Av-priority',
-          4: 'Manual',
-          5: 'A-DEP'}),
-    23: ('LongFocalLengthOfLensInFocalUnits', ),
-    24: ('ShortFocalLengthOfLensInFocalUnits', ),
-    25: ('FocalUnitsPerMM', ),
-    28: ('FlashActivity',
-         {0: 'Did Not Fire',
-          1: 'Fired'}),
-    29: ('FlashDetails',
-         {14: 'External E-TTL',
-          13: 'Internal Flash',
-          11: 'FP Sync Used',
-          7: '2nd("Rear")-Curtain Sync Used',
-          4: 'FP Sync Enabled'}),
-    32: ('FocusMode',
-         {0: 'Single',
-          1: 'Continuous'}),
-    }
+def get_makernote_tags(vendor):
+    try:
+        return _makernote_tags[vendor]
+    except KeyError:
+        _makernote_tags[vendor] = MAKERNOTE_BUILDERS[vendor]()
+        return _makernote_tags[vendor]
 
-MAKERNOTE_CANON_TAG_0x004 = {
-    7: ('WhiteBalance',
-        {0: 'Auto',
-         1: 'Sunny',
-         2: 'Cloudy',
-         3: 'Tungsten',
-         4: 'Fluorescent',
-         5: 'Flash',
-         6: 'Custom'}),
-    9: ('SequenceNumber', ),
-    14: ('AFPointUsed', ),
-    15: ('FlashBias',
-         {0xFFC0: '-2 EV',
-          0xFFCC: '-1.67 EV',
-          0xFFD0: '-1.50 EV',
-          0xFFD4: '-1.33 EV',
-          0xFFE0: '-1 EV',
-          0xFFEC: '-0.67 EV',
-          0xFFF0: '-0.50 EV',
-          0xFFF4: '-0.33 EV',
-          0x0000: '0 EV',
-          0x000C: '0.33 EV',
-          0x0010: '0.50 EV',
-          0x0014: '0.67 EV',
-          0x0020: '1 EV',
-          0x002C: '1.33 EV',
-          0x0030: '1.50 EV',
-          0x0034: '1.67 EV',
-          0x0040: '2 EV'}),
-    19: ('SubjectDistance', ),
-    }
+# tag number of each tag name of a tag table, None for names several tags
+# share; by id of the table, kept along so the id stays its own
+_tag_numbers = {}
+
+def get_tag_numbers(dict):
+    try:
+        return _tag_numbers[id(dict)][1]
+    except KeyError:
+        numbers = {}
+        for tag, tag_entry in dict.iteritems():
+            if tag_entry[0] in numbers:
+                numbers[tag_entry[0]] = None
+            else:
+                numbers[tag_entry[0]] = tag
+        _tag_numbers[id(dict)] = (dict, numbers)
+        return numbers
 
 # extract multibyte integer in Motorola format (little endian)
 def s2n_motorola(str):
@@ -1192,7 +1288,9 @@ def gcd(a, b):
     else:
         return gcd(b, a % b)
 
-class Ratio:
+class Ratio(object):
+    __slots__ = ('num', 'den')
+
     def __init__(self, num, den):
         self.num = num
         self.den = den
@@ -1209,12 +1307,89 @@ class Ratio:
             self.num = self.num / div
             self.den = self.den / div
 
+# decode count values of field_type at start in data: integers into an
+# array, Ratios into a list of Ratio, ASCII fields into a string
+def unpack_values(data, start, byte_order, field_type, count):
+    if field_type == 2:
+        # special case: null-terminated ASCII string
+        # XXX investigate
+        # sometimes gets too big to fit in int value
+        if count == 0 or count >= 2**31:
+            return ''
+        values = data[start:start+count]
+        if isinstance(values, memoryview):
+            values = values.tobytes()
+        # Drop any garbage after a null.
+        return values.split('\x00', 1)[0]
+    code = ARRAY_CODES.get(field_type)
+    if code:
+        size = count * FIELD_TYPES[field_type][0]
+        chunk = ''
+        if start >= 0:
+            chunk = data[start:start+size]
+            if isinstance(chunk, memoryview):
+                chunk = chunk.tobytes()
+        if len(chunk) < size:
+            # runs past the end of the data, decode it as if zero padded
+            chunk = chunk + '\x00' * (size - len(chunk))
+        values = array.array(code, chunk)
+        if byte_order != NATIVE_ORDER:
+            values.byteswap()
+        return values
+    # one value at a time, never compiling a struct for each count
+    st = get_struct(byte_order + FIELD_FORMATS[field_type])
+    size = count * st.size
+    chunk = ''
+    if start >= 0:
+        chunk = data[start:start+size]
+        if isinstance(chunk, memoryview):
+            chunk = chunk.tobytes()
+    if len(chunk) < size:
+        # runs past the end of the data, decode it as if zero padded
+        chunk = chunk + '\x00' * (size - len(chunk))
+    unpack = st.unpack_from
+    if field_type in (5, 10):
+        # a ratio
+        return [Ratio(*unpack(chunk, i)) for i in range(0, size, st.size)]
+    return [unpack(chunk, i)[0] for i in range(0, size, st.size)]
+
+# compute printable version of values
+def make_printable(tag_entry, field_type, count, values):
+    if isinstance(values, array.array):
+        values = values.tolist()
+    # now 'values' is either a string or an array
+    if count == 1 and field_type != 2:
+        printable=str(values[0])
+    elif count > 50 and len(values) > 20 :
+        printable=str( values[0:20] )[0:-1] + ", ... ]"
+    else:
+        printable=str(values)
+
+    if tag_entry:
+        if len(tag_entry) != 1:
+            # optional 2nd tag element is present
+            if callable(tag_entry[1]):
+                # call mapping function
+                printable = tag_entry[1](values)
+            else:
+                printable = ''
+                for i in values:
+                    # use lookup table for this tag
+                    printable += tag_entry[1].get(i, repr(i))
+    return printable
+
 # for ease of dealing with tags
-class IFD_Tag:
+# values and printable can be left out and given a source instead, a
+# (data, start, byte_order, count, tag_entry) tuple they are decoded from
+# the first time they are asked for
+class IFD_Tag(object):
+    __slots__ = ('_printable', 'tag', 'field_type', 'field_offset',
+                 'field_length', '_values', '_source')
+
     def __init__(self, printable, tag, field_type, values, field_offset,
-                 field_length):
+                 field_length, source=None):
         # printable version of data
-        self.printable = printable
+        self._printable = printable
         # tag ID number
         self.tag = tag
         # field type as index into FIELD_TYPES
@@ -1223,8 +1398,50 @@ class IFD_Tag:
         self.field_offset = field_offset
         # length of data field in bytes
         self.field_length = field_length
-        # either a string or array of data items
-        self.values = values
+        # either a string, an array of integers or a list of Ratio
+        self._values = values
+        # where to decode the above from
+        self._source = source
+
+    def _get_values(self):
+        if self._values is None and self._source is not None:
+            data, start, byte_order, count, tag_entry = self._source
+            self._values = unpack_values(data, start, byte_order,
+                                         self.field_type, count)
+            # printable only needs the values now, let go of the data
+            self._source = (None, 0, byte_order, count, tag_entry)
+        return self._values
+
+    def _set_values(self, values):
+        self._values = values
+
+    values = property(_get_values, _set_values)
+
+    def _get_printable(self):
+        if self._printable is None and self._source is not None:
+            count = self.field_length / FIELD_TYPES[self.field_type][0]
+            self._printable = make_printable(self._source[4],
+                                             self.field_type, count,
+                                             self.values)
+            # both decoded, let go of the data
+            self._source = None
+        return self._printable
+
+    def _set_printable(self, printable):
+        self._printable = printable
+
+    printable = property(_get_printable, _set_printable)
+
+    # keep only the bytes still to be decoded, not all of the data
+    def detach(self):
+        if self._source is not None and self._source[0] is not None:
+            data, start, byte_order, count, tag_entry = self._source
+            chunk = ''
+            if start >= 0:
+                chunk = data[start:start+count*FIELD_TYPES[self.field_type][0]]
+                if isinstance(chunk, memoryview):
+                    chunk = chunk.tobytes()
+            self._source = (chunk, 0, byte_order, count, tag_entry)
 
     def __str__(self):
         return self.printable
@@ -1242,24 +1459,121 @@ class IFD_Tag:
                                         str(self.field_offset))
         return s
 
+# handle on an embedded thumbnail, the bytes are only read (or put
+# together, for TIFF thumbnails) when asked for
+class Thumbnail(object):
+    __slots__ = ('offset', 'length', '_read')
+
+    def __init__(self, offset, length, read):
+        # where the thumbnail is, relative to the start of the EXIF data
+        self.offset = offset
+        # size of the thumbnail in bytes
+        self.length = length
+        # function of (offset, length) returning the bytes
+        self._read = read
+
+    def read(self):
+        return self._read(self.offset, self.length)
+
+    def __len__(self):
+        return self.length
+
+    def __str__(self):
+        return self.read()
+
+    def __repr__(self):
+        return '<Thumbnail of %d bytes @ %d>' % (self.length, self.offset)
+
+# length bytes at offset of the file named path
+def read_file(path, offset, length):
+    f = open(path, 'rb')
+    try:
+        f.seek(offset)
+        return f.read(length)
+    finally:
+        f.close()
+
 # class that handles an EXIF header
 class EXIF_header:
-    def __init__(self, file, endian, offset, fake_exif, strict, debug=0):
+    def __init__(self, file, endian, offset, fake_exif, strict, debug=0,
+                 data=None, data_offset=0, detailed=True):
         self.file = file
         self.endian = endian
         self.offset = offset
         self.fake_exif = fake_exif
         self.strict = strict
         self.debug = debug
+        # process MakerNote and UserComment tags
+        self.detailed = detailed
         self.tags = {}
+        # in-memory copy of the EXIF data (a memoryview of the APP1 segment
+        # or an mmap of the whole TIFF file); data_offset is the position in
+        # the file of its first byte
+        if data is None:
+            data = map_file(file)
+            data_offset = 0
+        self.data = data
+        self.data_offset = data_offset
+
+    # struct byte order character for our endian flag
+    def byte_order(self):
+        if self.endian == 'I':
+            return '<'
+        return '>'
+
+    # return a view of length bytes at offset, without copying if possible
+    def slice(self, offset, length):
+        start = self.offset + offset - self.data_offset
+        return self.data[start:start+length]
+
+    # once parsing is done, make tags stop referring to the header, its file
+    # and the data, so that a mapping of the file can be closed: tags keep
+    # their own bytes, JPEG images in a mapped file (previews of raw files
+    # can be megabytes) are read from it again by name, other thumbnails
+    # are copied
+    def release(self, tags):
+        path = None
+        for name, tag in tags.items():
+            if isinstance(tag, IFD_Tag):
+                tag.detach()
+                continue
+            if path is None and isinstance(self.data, mmap.mmap):
+                path = getattr(self.file, 'name', '')
+                if isinstance(path, str) and os.path.isfile(path):
+                    path = os.path.abspath(path)
+                else:
+                    path = ''
+            if path and name != 'TIFFThumbnail':
+                tag._read = lambda offset, length, path=path, \
+                    base=self.offset: read_file(path, base+offset, length)
+            else:
+                data = tag.read()
+                tag._read = lambda offset, length, data=data: data
+
+    # return length bytes at offset as a string
+    def read(self, offset, length):
+        data = self.slice(offset, length)
+        if isinstance(data, memoryview):
+            return data.tobytes()
+        return data
 
     # convert slice to integer, based on sign and endian flags
     # usually this offset is assumed to be relative to the beginning of the
     # start of the EXIF information.  For some cameras that use relative tags,
     # this offset may be relative to some other starting point.
     def s2n(self, offset, length, signed=0):
-        self.file.seek(self.offset+offset)
-        slice=self.file.read(length)
+        start = self.offset + offset - self.data_offset
+        if length in INT_FORMATS and start >= 0:
+            fmt = INT_FORMATS[length]
+            if signed:
+                fmt = fmt.lower()
+            try:
+                return get_struct(self.byte_order() + fmt).unpack_from(
+                    self.data, start)[0]
+            except struct.error:
+                # runs past the end of the data, decode what there is
+                pass
+        slice=self.slice(offset, length)
         if self.endian == 'I':
             val=s2n_intel(slice)
         else:
@@ -1300,13 +1614,35 @@ class EXIF_header:
             i=self.next_IFD(i)
         return a
 
+    # true once every one of the given tags has been found
+    def found(self, tags):
+        return tags is not None and tags.issubset(self.tags)
+
     # return list of entries in this IFD
-    def dump_IFD(self, ifd, ifd_name, dict=EXIF_TAGS, relative=0, stop_tag='UNDEF'):
+    def dump_IFD(self, ifd, ifd_name, dict=EXIF_TAGS, relative=0, stop_tag='UNDEF',
+                 tags=None):
+        # when only some tags are wanted, stop once we have all of them
+        if tags is not None:
+            remaining = set([name for name in tags
+                             if name.startswith(ifd_name + ' ')
+                             and name not in self.tags])
+            if not remaining:
+                return
         entries=self.s2n(ifd, 2)
+        # unpack the directory as (tag, type, count, value/offset)
+        # quadruples; a directory running past the end of the data is cut
+        # short
+        start = self.offset - self.data_offset + ifd + 2
+        fit = max(0, (len(self.data) - start) // 12)
+        if entries > fit:
+            if self.strict:
+                raise ValueError('IFD at offset %d is truncated' % ifd)
+            entries = fit
+        unpack = get_struct(self.byte_order() + 'HHLL').unpack_from
         for i in range(entries):
             # entry is index of start of this IFD in the file
             entry = ifd + 2 + 12 * i
-            tag = self.s2n(entry, 2)
+            tag, field_type, count, pointer = unpack(self.data, start + 12 * i)
 
             # get tag name early to avoid errors, help debug
             tag_entry = dict.get(tag)
@@ -1315,134 +1651,162 @@ class EXIF_header:
             else:
                 tag_name = 'Tag 0x%04X' % tag
 
-            # ignore certain tags for faster processing
-            if not (not detailed and tag in IGNORE_TAGS):
-                field_type = self.s2n(entry + 2, 2)
-                
-                # unknown field type
-                if not 0 < field_type < len(FIELD_TYPES):
-                    if not self.strict:
-                        continue
-                    else:
-                        raise ValueError('unknown type %d in tag 0x%04X' % (field_type, tag))
-
-                typelen = FIELD_TYPES[field_type][0]
-                count = self.s2n(entry + 4, 4)
-                # Adjust for tag id/type/count (2+2+4 bytes)
-                # Now we point at either the data or the 2nd level offset
-                offset = entry + 8
-
-                # If the value fits in 4 bytes, it is inlined, else we
-                # need to jump ahead again.
-                if count * typelen > 4:
-                    # offset is not the value; it's a pointer to the value
-                    # if relative we set things up so s2n will seek to the right
-                    # place when it adds self.offset.  Note that this 'relative'
-                    # is for the Nikon type 3 makernote.  Other cameras may use
-                    # other relative offsets, which would have to be computed here
-                    # slightly differently.
-                    if relative:
-                        tmp_offset = self.s2n(offset, 4)
-                        offset = tmp_offset + ifd - 8
-                        if self.fake_exif:
-                            offset = offset + 18
-                    else:
-                        offset = self.s2n(offset, 4)
-
-                field_offset = offset
-                if field_type == 2:
-                    # special case: null-terminated ASCII string
-                    # XXX investigate
-                    # sometimes gets too big to fit in int value
-                    if count != 0 and count < (2**31):
-                        self.file.seek(self.offset + offset)
-                        values = self.file.read(count)
-                        #print values
-                        # Drop any garbage after a null.
-                        values = values.split('\x00', 1)[0]
-                    else:
-                        values = ''
-                else:
-                    values = []
-                    signed = (field_type in [6, 8, 9, 10])
-                    
-                    # XXX investigate
-                    # some entries get too big to handle could be malformed
-                    # file or problem with self.s2n
-                    if count < 1000:
-                        for dummy in range(count):
-                            if field_type in (5, 10):
-                                # a ratio
-                                value = Ratio(self.s2n(offset, 4, signed),
-                                              self.s2n(offset + 4, 4, signed))
-                            else:
-                                value = self.s2n(offset, typelen, signed)
-                            values.append(value)
-                            offset = offset + typelen
-                    # The test above causes problems with tags that are 
-                    # supposed to have long values!  Fix up one important case.
-                    elif tag_name == 'MakerNote' :
-                        for dummy in range(count):
-                            value = self.s2n(offset, typelen, signed)
-                            values.append(value)
-                            offset = offset + typelen
-                    #else :
-                    #    print "Warning: dropping large tag:", tag, tag_name
-                
-                # now 'values' is either a string or an array
-                if count == 1 and field_type != 2:
-                    printable=str(values[0])
-                elif count > 50 and len(values) > 20 :
-                    printable=str( values[0:20] )[0:-1] + ", ... ]"
-                else:
-                    printable=str(values)
-
-                # compute printable version of values
-                if tag_entry:
-                    if len(tag_entry) != 1:
-                        # optional 2nd tag element is present
-                        if callable(tag_entry[1]):
-                            # call mapping function
-                            printable = tag_entry[1](values)
-                        else:
-                            printable = ''
-                            for i in values:
-                                # use lookup table for this tag
-                                printable += tag_entry[1].get(i, repr(i))
-
-                self.tags[ifd_name + ' ' + tag_name] = IFD_Tag(printable, tag,
-                                                          field_type,
-                                                          values, field_offset,
-                                                          count * typelen)
-                if self.debug:
-                    print ' debug:   %s: %s' % (tag_name,
-                                                repr(self.tags[ifd_name + ' ' + tag_name]))
+            # ignore certain tags for faster processing, and the ones we
+            # were not asked for
+            wanted = tags is None or ifd_name + ' ' + tag_name in tags
+            if wanted and not (not self.detailed and tag in IGNORE_TAGS):
+                if not self.add_IFD_tag(ifd, ifd_name, entry, tag, field_type,
+                                        count, pointer, tag_entry, relative):
+                    continue
+                if tags is not None:
+                    remaining.discard(ifd_name + ' ' + tag_name)
+                    if not remaining:
+                        break
 
             if tag_name == stop_tag:
                 break
 
-    # extract uncompressed TIFF thumbnail (like pulling teeth)
+    # add the tag of the IFD entry at entry, given its unpacked (tag, type,
+    # count, value/offset); False if it has an unknown field type
+    def add_IFD_tag(self, ifd, ifd_name, entry, tag, field_type, count,
+                    pointer, tag_entry, relative=0):
+        if tag_entry:
+            tag_name = tag_entry[0]
+        else:
+            tag_name = 'Tag 0x%04X' % tag
+
+        # unknown field type
+        if not 0 < field_type < len(FIELD_TYPES):
+            if not self.strict:
+                return False
+            else:
+                raise ValueError('unknown type %d in tag 0x%04X' % (field_type, tag))
+
+        typelen = FIELD_TYPES[field_type][0]
+        # Adjust for tag id/type/count (2+2+4 bytes)
+        # Now we point at either the data or the 2nd level offset
+        offset = entry + 8
+
+        # If the value fits in 4 bytes, it is inlined, else we
+        # need to jump ahead again.
+        if count * typelen > 4:
+            # offset is not the value; it's a pointer to the value
+            # if relative we set things up so s2n will seek to the right
+            # place when it adds self.offset.  Note that this 'relative'
+            # is for the Nikon type 3 makernote.  Other cameras may use
+            # other relative offsets, which would have to be computed here
+            # slightly differently.
+            if relative:
+                offset = pointer + ifd - 8
+                if self.fake_exif:
+                    offset = offset + 18
+            else:
+                offset = pointer
+
+        field_offset = offset
+        # XXX investigate
+        # some entries get too big to handle could be malformed
+        # file or problem with self.s2n
+        # The test causes problems with tags that are supposed to
+        # have long values!  Fix up one important case.
+        if field_type != 2 and count >= 1000 and tag_name != 'MakerNote':
+            #print "Warning: dropping large tag:", tag, tag_name
+            decode_count = 0
+        else:
+            decode_count = count
+
+        # values and printable are only decoded when first used
+        source = (self.data, self.offset + offset - self.data_offset,
+                  self.byte_order(), decode_count, tag_entry)
+        self.tags[ifd_name + ' ' + tag_name] = IFD_Tag(None, tag,
+                                                  field_type, None,
+                                                  field_offset,
+                                                  count * typelen,
+                                                  source)
+        if self.debug:
+            print ' debug:   %s: %s' % (tag_name,
+                                        repr(self.tags[ifd_name + ' ' + tag_name]))
+        return True
+
+    # look the given tags of the IFD at ifd up by binary search, the entries
+    # of an IFD being sorted by tag, instead of going through all of them;
+    # whatever is not found that way (unknown names, IFDs out of order) is
+    # left to dump_IFD
+    def search_IFD(self, ifd, ifd_name, dict, tags, relative=0):
+        numbers = get_tag_numbers(dict)
+        entries = self.s2n(ifd, 2)
+        start = self.offset - self.data_offset + ifd + 2
+        entries = min(entries, max(0, (len(self.data) - start) // 12))
+        unpack = get_struct(self.byte_order() + 'HHLL').unpack_from
+        missing = False
+        for name in tags:
+            if not name.startswith(ifd_name + ' ') or name in self.tags:
+                continue
+            tag = numbers.get(name[len(ifd_name) + 1:])
+            low, high = 0, entries
+            while tag is not None and low < high:
+                middle = (low + high) // 2
+                entry_tag = unpack(self.data, start + 12 * middle)[0]
+                if entry_tag < tag:
+                    low = middle + 1
+                else:
+                    high = middle
+            if tag is None or low == entries or \
+                unpack(self.data, start + 12 * low)[0] != tag:
+                missing = True
+                continue
+            tag, field_type, count, pointer = unpack(self.data,
+                                                     start + 12 * low)
+            self.add_IFD_tag(ifd, ifd_name, ifd + 2 + 12 * low, tag,
+                             field_type, count, pointer, dict[tag], relative)
+        if missing:
+            self.dump_IFD(ifd, ifd_name, dict=dict, relative=relative,
+                          tags=tags)
+
+    # decode the entries of the thumbnail IFD as (tag, typelen, count,
+    # offset) tuples
+    def TIFF_thumbnail_entries(self, thumb_ifd):
+        entries = []
+        for i in range(self.s2n(thumb_ifd, 2)):
+            entry = thumb_ifd + 2 + 12 * i
+            field_type = self.s2n(entry+2, 2)
+            entries.append((self.s2n(entry, 2), FIELD_TYPES[field_type][0],
+                            self.s2n(entry+4, 4), self.s2n(entry+8, 4)))
+        return entries
+
+    # set up a handle on the uncompressed TIFF thumbnail, which only gets
+    # put together when it is read
+    def extract_TIFF_thumbnail(self, thumb_ifd):
+        # no thumbnail to put together without the strips
+        if 'Thumbnail StripOffsets' not in self.tags or \
+           'Thumbnail StripByteCounts' not in self.tags:
+            return
+        entries = self.TIFF_thumbnail_entries(thumb_ifd)
+        # header, IFD, "next IFD" pointer, data area and pixel strips
+        length = 8 + 2 + 12 * len(entries) + 4
+        for tag, typelen, count, oldoff in entries:
+            if count * typelen > 4:
+                length += count * typelen
+        length += sum(self.tags['Thumbnail StripByteCounts'].values)
+        self.tags['TIFFThumbnail'] = Thumbnail(thumb_ifd, length,
+                                               self.assemble_TIFF_thumbnail)
+
+    # assemble uncompressed TIFF thumbnail (like pulling teeth)
     # we take advantage of the pre-existing layout in the thumbnail IFD as
     # much as possible
-    def extract_TIFF_thumbnail(self, thumb_ifd):
-        entries = self.s2n(thumb_ifd, 2)
+    def assemble_TIFF_thumbnail(self, thumb_ifd, length):
+        entries = self.TIFF_thumbnail_entries(thumb_ifd)
         # this is header plus offset to IFD ...
         if self.endian == 'M':
-            tiff = 'MM\x00*\x00\x00\x00\x08'
+            tiff = bytearray('MM\x00*\x00\x00\x00\x08')
         else:
-            tiff = 'II*\x00\x08\x00\x00\x00'
+            tiff = bytearray('II*\x00\x08\x00\x00\x00')
         # ... plus thumbnail IFD data plus a null "next IFD" pointer
-        self.file.seek(self.offset+thumb_ifd)
-        tiff += self.file.read(entries*12+2)+'\x00\x00\x00\x00'
+        tiff += self.read(thumb_ifd, len(entries)*12+2)+'\x00\x00\x00\x00'
 
         # fix up large value offset pointers into data area
-        for i in range(entries):
-            entry = thumb_ifd + 2 + 12 * i
-            tag = self.s2n(entry, 2)
-            field_type = self.s2n(entry+2, 2)
-            typelen = FIELD_TYPES[field_type][0]
-            count = self.s2n(entry+4, 4)
-            oldoff = self.s2n(entry+8, 4)
+        for i in range(len(entries)):
+            tag, typelen, count, oldoff = entries[i]
             # start of the 4-byte pointer area in entry
             ptr = i * 12 + 18
             # remember strip offsets location
@@ -1451,31 +1815,50 @@ class EXIF_header:
                 strip_len = count * typelen
             # is it in the data area?
             if count * typelen > 4:
-                # update offset pointer (nasty "strings are immutable" crap)
-                # should be able to say "tiff[ptr:ptr+4]=newoff"
+                # update offset pointer
                 newoff = len(tiff)
-                tiff = tiff[:ptr] + self.n2s(newoff, 4) + tiff[ptr+4:]
+                tiff[ptr:ptr+4] = self.n2s(newoff, 4)
                 # remember strip offsets location
                 if tag == 0x0111:
                     strip_off = newoff
                     strip_len = 4
                 # get original data and store it
-                self.file.seek(self.offset + oldoff)
-                tiff += self.file.read(count * typelen)
+                tiff += self.read(oldoff, count * typelen)
 
         # add pixel strips and update strip offset info
         old_offsets = self.tags['Thumbnail StripOffsets'].values
         old_counts = self.tags['Thumbnail StripByteCounts'].values
         for i in range(len(old_offsets)):
-            # update offset pointer (more nasty "strings are immutable" crap)
-            offset = self.n2s(len(tiff), strip_len)
-            tiff = tiff[:strip_off] + offset + tiff[strip_off + strip_len:]
+            # update offset pointer
+            tiff[strip_off:strip_off+strip_len] = self.n2s(len(tiff), strip_len)
             strip_off += strip_len
             # add pixel strip to end
-            self.file.seek(self.offset + old_offsets[i])
-            tiff += self.file.read(old_counts[i])
-
-        self.tags['TIFFThumbnail'] = tiff
+            tiff += self.read(old_offsets[i], old_counts[i])
+
+        return str(tiff)
+
+    # set up a handle on the largest JPEG image stored in the given IFDs,
+    # for raw files that is the full size preview
+    def extract_JPEG_preview(self, ifd_names):
+        preview = None
+        for name in ifd_names:
+            start = self.tags.get(name+' JPEGInterchangeFormat')
+            length = self.tags.get(name+' JPEGInterchangeFormatLength')
+            if not (start and length):
+                # DNG keeps its previews as a single JPEG compressed strip
+                subfile = self.tags.get(name+' NewSubfileType')
+                compression = self.tags.get(name+' Compression')
+                start = self.tags.get(name+' StripOffsets')
+                length = self.tags.get(name+' StripByteCounts')
+                if not (subfile and subfile.values[0] == 1 and
+                        compression and compression.values[0] in (6, 7) and
+                        start and length and len(start.values) == 1):
+                    continue
+            if not preview or length.values[0] > preview.length:
+                preview = Thumbnail(start.values[0], length.values[0],
+                                    self.read)
+        if preview:
+            self.tags['JPEGPreview'] = preview
 
     # decode all the camera-specific MakerNote formats
 
@@ -1496,7 +1879,7 @@ class EXIF_header:
     # follow EXIF format internally.  Once they did, it's ambiguous whether
     # the offsets should be from the header at the start of all the EXIF info,
     # or from the header at the start of the makernote.)
-    def decode_maker_note(self):
+    def decode_maker_note(self, tags=None):
         note = self.tags['EXIF MakerNote']
         
         # Some apps use MakerNote tags but do not use a format for which we
@@ -1514,40 +1897,51 @@ class EXIF_header:
         # not at the start of the makernote, it's probably type 2, since some
         # cameras work that way.
         if 'NIKON' in make:
-            if note.values[0:7] == [78, 105, 107, 111, 110, 0, 1]:
+            newer, older = get_makernote_tags('nikon')
+            if list(note.values[0:7]) == [78, 105, 107, 111, 110, 0, 1]:
                 if self.debug:
                     print "Looks like a type 1 Nikon MakerNote."
                 self.dump_IFD(note.field_offset+8, 'MakerNote',
-                              dict=MAKERNOTE_NIKON_OLDER_TAGS)
-            elif note.values[0:7] == [78, 105, 107, 111, 110, 0, 2]:
+                              dict=older, tags=tags)
+            elif list(note.values[0:7]) == [78, 105, 107, 111, 110, 0, 2]:
                 if self.debug:
                     print "Looks like a labeled type 2 Nikon MakerNote"
-                if note.values[12:14] != [0, 42] and note.values[12:14] != [42L, 0L]:
+                if list(note.values[12:14]) not in ([0, 42], [42, 0]):
                     raise ValueError("Missing marker tag '42' in MakerNote.")
                 # skip the Makernote label and the TIFF header
-                self.dump_IFD(note.field_offset+10+8, 'MakerNote',
-                              dict=MAKERNOTE_NIKON_NEWER_TAGS, relative=1)
+                if tags is None:
+                    self.dump_IFD(note.field_offset+10+8, 'MakerNote',
+                                  dict=newer, relative=1)
+                else:
+                    # e.g. just the shutter count, no need to go through
+                    # the whole MakerNote
+                    self.search_IFD(note.field_offset+10+8, 'MakerNote',
+                                    newer, tags, relative=1)
             else:
                 # E99x or D1
                 if self.debug:
                     print "Looks like an unlabeled type 2 Nikon MakerNote"
-                self.dump_IFD(note.field_offset, 'MakerNote',
-                              dict=MAKERNOTE_NIKON_NEWER_TAGS)
+                if tags is None:
+                    self.dump_IFD(note.field_offset, 'MakerNote', dict=newer)
+                else:
+                    self.search_IFD(note.field_offset, 'MakerNote', newer,
+                                    tags)
             return
 
         # Olympus
         if make.startswith('OLYMPUS'):
+            olympus, tag_0x2020 = get_makernote_tags('olympus')
             self.dump_IFD(note.field_offset+8, 'MakerNote',
-                          dict=MAKERNOTE_OLYMPUS_TAGS)
+                          dict=olympus, tags=tags)
             # XXX TODO
-            #for i in (('MakerNote Tag 0x2020', MAKERNOTE_OLYMPUS_TAG_0x2020),):
+            #for i in (('MakerNote Tag 0x2020', tag_0x2020),):
             #    self.decode_olympus_tag(self.tags[i[0]].values, i[1])
             #return
 
         # Casio
         if 'CASIO' in make or 'Casio' in make:
             self.dump_IFD(note.field_offset, 'MakerNote',
-                          dict=MAKERNOTE_CASIO_TAGS)
+                          dict=get_makernote_tags('casio'), tags=tags)
             return
 
         # Fujifilm
@@ -1561,7 +1955,8 @@ class EXIF_header:
             offset = self.offset
             self.offset += note.field_offset
             # process note with bogus values (note is actually at offset 12)
-            self.dump_IFD(12, 'MakerNote', dict=MAKERNOTE_FUJIFILM_TAGS)
+            self.dump_IFD(12, 'MakerNote',
+                          dict=get_makernote_tags('fujifilm'), tags=tags)
             # reset to correct values
             self.endian = endian
             self.offset = offset
@@ -1569,10 +1964,11 @@ class EXIF_header:
 
         # Canon
         if make == 'Canon':
+            canon, tag_0x001, tag_0x004 = get_makernote_tags('canon')
             self.dump_IFD(note.field_offset, 'MakerNote',
-                          dict=MAKERNOTE_CANON_TAGS)
-            for i in (('MakerNote Tag 0x0001', MAKERNOTE_CANON_TAG_0x001),
-                      ('MakerNote Tag 0x0004', MAKERNOTE_CANON_TAG_0x004)):
+                          dict=canon, tags=tags)
+            for i in (('MakerNote Tag 0x0001', tag_0x001),
+                      ('MakerNote Tag 0x0004', tag_0x004)):
                 try: self.canon_decode_tag(self.tags[i[0]].values, i[1])  # gd added 
                 except KeyError: pass
             return
@@ -1599,14 +1995,113 @@ class EXIF_header:
             self.tags['MakerNote '+name]=IFD_Tag(str(val), None, 0, None,
                                                  None, None)
 
+# one segment of a JPEG file: its marker, the file offset of the marker,
+# its length as stored (which counts the 2 length bytes) and the first
+# bytes of its payload for APPn segments
+class JPEG_Segment(object):
+    __slots__ = ('marker', 'offset', 'length', 'ident', 'name')
+
+    def __init__(self, marker, offset, length, ident=''):
+        self.marker = marker
+        self.offset = offset
+        self.length = length
+        self.ident = ident
+        # what the segment holds, for the ones we know about
+        if marker == 0xE1 and ident[:4] == 'Exif':
+            self.name = 'Exif'
+        elif marker == 0xE1 and ident.startswith('http://ns.adobe.com/xap/1.0/'):
+            self.name = 'XMP'
+        elif marker == 0xE2 and ident.startswith('ICC_PROFILE'):
+            self.name = 'ICC'
+        elif marker == 0xED and ident.startswith('Photoshop 3.0'):
+            self.name = 'IPTC'
+        elif 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            self.name = 'SOF'
+        elif marker == 0xDA:
+            self.name = 'SOS'
+        elif 0xE0 <= marker <= 0xEF:
+            self.name = 'APP%d' % (marker - 0xE0)
+        else:
+            self.name = '0x%02X' % marker
+
+    def __repr__(self):
+        return '<JPEG %s segment of %d bytes @ %d>' % (self.name, self.length,
+                                                       self.offset)
+
+# list the segments of a JPEG file up to the start of scan, reading only
+# the marker and length of each (plus a few bytes of APPn payloads to tell
+# what they are) and seeking over the rest
+def jpeg_segments(f):
+    segments = []
+    f.seek(0)
+    if f.read(2) != '\xFF\xD8':
+        return segments
+    offset = 2
+    while 1:
+        header = f.read(4)
+        if len(header) < 2 or header[0] != '\xFF':
+            break
+        marker = ord(header[1])
+        if marker == 0xFF:
+            # fill byte
+            offset = offset+1
+        elif 0xD0 <= marker <= 0xD7 or marker == 0x01:
+            # markers without a length
+            offset = offset+2
+        elif marker == 0xD9 or len(header) < 4:
+            # end of image
+            break
+        else:
+            length = ord(header[2])*256+ord(header[3])
+            if length < 2:
+                break
+            ident = ''
+            if 0xE0 <= marker <= 0xEF:
+                ident = f.read(min(length-2, 32))
+            segments.append(JPEG_Segment(marker, offset, length, ident))
+            if marker == 0xDA:
+                # start of scan, image data follows
+                break
+            offset = offset+2+length
+        f.seek(offset)
+    return segments
+
+# tags that have to be decoded to get at the given ones: the tags themselves
+# plus the pointers and tags leading to their IFDs
+def lookup_tags(tags):
+    lookup = set(tags)
+    groups = set([name.split(' ', 1)[0] for name in tags])
+    if 'EXIF' in groups or 'MakerNote' in groups:
+        lookup.add('Image ExifOffset')
+    if 'GPS' in groups:
+        lookup.add('Image GPSInfo')
+    if 'MakerNote' in groups:
+        lookup.update(('EXIF MakerNote', 'Image Make'))
+    if 'JPEGThumbnail' in groups:
+        lookup.update(('Thumbnail JPEGInterchangeFormat',
+                       'Thumbnail JPEGInterchangeFormatLength'))
+    if 'TIFFThumbnail' in groups:
+        lookup.update(('Thumbnail Compression', 'Thumbnail StripOffsets',
+                       'Thumbnail StripByteCounts'))
+    if 'JPEGPreview' in groups:
+        lookup.add('Image SubIFDs')
+        lookup.update(['Image ' + name for name in PREVIEW_TAGS])
+    return lookup
+
+# map a whole file into memory, read-only; file objects that cannot be
+# mapped (pipes, StringIO, empty files) are simply read in
+def map_file(f):
+    try:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, ValueError, EnvironmentError):
+        f.seek(0)
+        return f.read()
+
 # process an image file (expects an open file object)
 # this is the function that has to deal with all the arbitrary nasty bits
 # of the EXIF standard
-def process_file(f, stop_tag='UNDEF', details=True, strict=False, debug=False):
-    # yah it's cheesy...
-    global detailed
-    detailed = details
-
+def process_file(f, stop_tag='UNDEF', details=True, strict=False, debug=False,
+                 tags=None):
     # by default do not fake an EXIF beginning
     fake_exif = 0
 
@@ -1618,57 +2113,29 @@ def process_file(f, stop_tag='UNDEF', details=True, strict=False, debug=False):
         endian = f.read(1)
         f.read(1)
         offset = 0
+        # IFDs and values can be anywhere in a TIFF, so map all of it
+        buf = map_file(f)
     elif data[0:2] == '\xFF\xD8':
         # it's a JPEG file
         if debug: print "JPEG format recognized."
-        base = 0
-        while data[2] == '\xFF' and data[6:10] in ('JFIF', 'JFXX', 'OLYM', 'Phot'):
-            length = ord(data[4])*256+ord(data[5])
-            f.read(length-8)
-            # fake an EXIF beginning of file
-            data = '\xFF\x00'+f.read(10)
+        segments = jpeg_segments(f)
+        # fake an EXIF beginning of file
+        if segments and segments[0].ident[:4] in ('JFIF', 'JFXX', 'OLYM', 'Phot'):
             fake_exif = 1
-            base = base + length
 
-        # Big ugly patch to deal with APP2 (or other) data coming before APP1
-        f.seek(0)
-        data = f.read(base+4000) # in theory, this could be insufficient --gd
-        base = 2
-        while 1:
-            if data[base:base+2]=='\xFF\xE1':
-                # APP1
-                #print "APP1 at base",hex(base)
-                #print "Length",hex(ord(data[base+2])), hex(ord(data[base+3]))
-                #print "Code",data[base+4:base+8]
-                if data[base+4:base+8] == "Exif":
-                    base = base-2
-                    break
-                base=base+ord(data[base+2])*256+ord(data[base+3])+2
-            elif data[base:base+2]=='\xFF\xE2':
-                # APP2
-                #print "APP2 at base",hex(base)
-                #print "Length",hex(ord(data[base+2])), hex(ord(data[base+3]))
-                #print "Code",data[base+4:base+8]
-                base=base+ord(data[base+2])*256+ord(data[base+3])+2
-            elif data[base:base+2]=='\xFF\xE0':
-                # APP0
-                #print "APP0 at base",hex(base)
-                #print "Length",hex(ord(data[base+2])), hex(ord(data[base+3]))
-                #print "Code",data[base+4:base+8]
-                base=base+ord(data[base+2])*256+ord(data[base+3])+2
-            else: 
-                break
-
-        f.seek(base+12)
-        if data[2+base] == '\xFF' and data[6+base:10+base] == 'Exif':
-            # detected EXIF header
-            offset = f.tell()
-            endian = f.read(1)
+        exif = [seg for seg in segments if seg.name == 'Exif']
+        if exif:
+            # detected EXIF header, everything we need is in this APP1
+            # segment so read it in one go
+            offset = exif[0].offset+10
+            f.seek(offset)
+            buf = memoryview(f.read(exif[0].length-8))
+            endian = buf[0]
             #HACK TEST:  endian = 'M'
         else:
             # no EXIF information
             if debug: print "no EXIF header"
-            if debug: print "Had",hex(ord(data[2+base])) , "and", data[6+base:10+base]
+            if debug: print "Had", [seg.name for seg in segments]
             return {}
     else:
         # file format not recognized
@@ -1678,9 +2145,20 @@ def process_file(f, stop_tag='UNDEF', details=True, strict=False, debug=False):
     # deal with the EXIF info we found
     if debug:
         print {'I': 'Intel', 'M': 'Motorola'}[endian], 'format'
-    hdr = EXIF_header(f, endian, offset, fake_exif, strict, debug)
-    ifd_list = hdr.list_IFDs()
+    hdr = EXIF_header(f, endian, offset, fake_exif, strict, debug,
+                      buf, offset, details)
+    wanted = lookup = None
+    if tags is not None:
+        wanted = set(tags)
+        lookup = lookup_tags(wanted)
+    if lookup is None or [name for name in lookup
+                          if name.startswith(('Thumbnail ', 'IFD '))]:
+        ifd_list = hdr.list_IFDs()
+    else:
+        # everything we want hangs off the first IFD
+        ifd_list = [hdr.first_IFD()]
     ctr = 0
+    sub_ifd_names = []
     for i in ifd_list:
         if ctr == 0:
             IFD_name = 'Image'
@@ -1691,13 +2169,14 @@ def process_file(f, stop_tag='UNDEF', details=True, strict=False, debug=False):
             IFD_name = 'IFD %d' % ctr
         if debug:
             print ' IFD %d (%s) at offset %d:' % (ctr, IFD_name, i)
-        hdr.dump_IFD(i, IFD_name, stop_tag=stop_tag)
+        hdr.dump_IFD(i, IFD_name, stop_tag=stop_tag, tags=lookup)
         # EXIF IFD
         exif_off = hdr.tags.get(IFD_name+' ExifOffset')
         if exif_off:
             if debug:
                 print ' EXIF SubIFD at offset %d:' % exif_off.values[0]
-            hdr.dump_IFD(exif_off.values[0], 'EXIF', stop_tag=stop_tag)
+            hdr.dump_IFD(exif_off.values[0], 'EXIF', stop_tag=stop_tag,
+                         tags=lookup)
             # Interoperability IFD contained in EXIF IFD
             intr_off = hdr.tags.get('EXIF SubIFD InteroperabilityOffset')
             if intr_off:
@@ -1705,42 +2184,70 @@ def process_file(f, stop_tag='UNDEF', details=True, strict=False, debug=False):
                     print ' EXIF Interoperability SubSubIFD at offset %d:' \
                           % intr_off.values[0]
                 hdr.dump_IFD(intr_off.values[0], 'EXIF Interoperability',
-                             dict=INTR_TAGS, stop_tag=stop_tag)
+                             dict=INTR_TAGS, stop_tag=stop_tag, tags=lookup)
         # GPS IFD
         gps_off = hdr.tags.get(IFD_name+' GPSInfo')
         if gps_off:
             if debug:
                 print ' GPS SubIFD at offset %d:' % gps_off.values[0]
-            hdr.dump_IFD(gps_off.values[0], 'GPS', dict=GPS_TAGS, stop_tag=stop_tag)
+            hdr.dump_IFD(gps_off.values[0], 'GPS', dict=GPS_TAGS, stop_tag=stop_tag,
+                         tags=lookup)
+        # SubIFDs, where raw files keep their preview and raw data
+        sub_ifds = hdr.tags.get(IFD_name+' SubIFDs')
+        if sub_ifds:
+            for sub_ifd in sub_ifds.values:
+                sub_name = 'SubIFD %d' % len(sub_ifd_names)
+                sub_ifd_names.append(sub_name)
+                if debug:
+                    print ' %s at offset %d:' % (sub_name, sub_ifd)
+                if lookup is not None and 'JPEGPreview' in lookup:
+                    lookup.update([sub_name + ' ' + name
+                                   for name in PREVIEW_TAGS])
+                hdr.dump_IFD(sub_ifd, sub_name, stop_tag=stop_tag, tags=lookup)
         ctr += 1
+        if hdr.found(wanted):
+            break
 
     # extract uncompressed TIFF thumbnail
     thumb = hdr.tags.get('Thumbnail Compression')
-    if thumb and thumb.printable == 'Uncompressed TIFF':
+    if thumb and thumb.values[0] == 1 and \
+       (wanted is None or 'TIFFThumbnail' in wanted):
         hdr.extract_TIFF_thumbnail(thumb_ifd)
 
+    # full size JPEG preview of raw files
+    if lookup is None or 'JPEGPreview' in lookup:
+        hdr.extract_JPEG_preview(['Image'] + sub_ifd_names)
+
     # JPEG thumbnail (thankfully the JPEG data is stored as a unit)
     thumb_off = hdr.tags.get('Thumbnail JPEGInterchangeFormat')
-    if thumb_off:
-        f.seek(offset+thumb_off.values[0])
+    if thumb_off and (wanted is None or 'JPEGThumbnail' in wanted):
         size = hdr.tags['Thumbnail JPEGInterchangeFormatLength'].values[0]
-        hdr.tags['JPEGThumbnail'] = f.read(size)
+        hdr.tags['JPEGThumbnail'] = Thumbnail(thumb_off.values[0], size,
+                                              hdr.read)
 
     # deal with MakerNote contained in EXIF IFD
     # (Some apps use MakerNote tags but do not use a format for which we
     # have a description, do not process these).
-    if 'EXIF MakerNote' in hdr.tags and 'Image Make' in hdr.tags and detailed:
-        hdr.decode_maker_note()
+    if 'EXIF MakerNote' in hdr.tags and 'Image Make' in hdr.tags and details:
+        hdr.decode_maker_note(tags=lookup)
 
     # Sometimes in a TIFF file, a JPEG thumbnail is hidden in the MakerNote
     # since it's not allowed in a uncompressed TIFF IFD
     if 'JPEGThumbnail' not in hdr.tags:
         thumb_off=hdr.tags.get('MakerNote JPEGThumbnail')
         if thumb_off:
-            f.seek(offset+thumb_off.values[0])
-            hdr.tags['JPEGThumbnail']=file.read(thumb_off.field_length)
+            hdr.tags['JPEGThumbnail']=Thumbnail(thumb_off.values[0],
+                                                thumb_off.field_length,
+                                                hdr.read)
 
-    return hdr.tags
+    result = hdr.tags
+    if wanted is not None:
+        result = dict([(name, hdr.tags[name]) for name in wanted
+                       if name in hdr.tags])
+    hdr.release(result)
+    if isinstance(buf, mmap.mmap):
+        buf.close()
+    return result
 
 
 # show command line usage
@@ -1799,7 +2306,7 @@ if __name__ == '__main__':
         x=data.keys()
         x.sort()
         for i in x:
-            if i in ('JPEGThumbnail', 'TIFFThumbnail'):
+            if i in ('JPEGThumbnail', 'TIFFThumbnail', 'JPEGPreview'):
                 continue
             try:
                 print '   %s (%s): %s' % \
@@ -1808,5 +2315,7 @@ if __name__ == '__main__':
                 print 'error', i, '"', data[i], '"'
         if 'JPEGThumbnail' in data:
             print 'File has JPEG thumbnail'
+        if 'JPEGPreview' in data:
+            print 'File has JPEG preview'
         print
 
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+'''Memory the tags of one raw file take once parsed and decoded
+
+    python bench_exif.py [DIR]
+
+measures the EXIF.py in DIR (default: the one next to this script), so
+two versions can be compared, e.g. for the one before dde8f57:
+
+    mkdir /tmp/before && git show dde8f57^:src/EXIF.py > /tmp/before/EXIF.py
+    python bench_exif.py /tmp/before'''
+
+import os
+import sys
+import types
+from StringIO import StringIO
+
+if __name__ == '__main__':
+    sys.path.insert(0, sys.argv[1] if len(sys.argv) > 1 else
+        os.path.dirname(os.path.abspath(__file__)))
+
+import EXIF
+from test_exif import NOTE_SIZE, make_nef
+
+
+def deep_size(value, seen=None):
+    '''Bytes taken by value and everything it refers to, counting shared
+    objects (small ints, interned strings) once'''
+    if seen is None:
+        seen = set()
+    if id(value) in seen or isinstance(value, (type, types.ClassType,
+            types.FunctionType, types.MethodType, types.ModuleType)):
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for key, item in value.items():
+            size += deep_size(key, seen) + deep_size(item, seen)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            size += deep_size(item, seen)
+    if hasattr(value, '__dict__'):
+        size += deep_size(value.__dict__, seen)
+    for cls in type(value).__mro__:
+        for name in getattr(cls, '__slots__', ()):
+            if hasattr(value, name):
+                size += deep_size(getattr(value, name), seen)
+    return size
+
+
+def tag_sizes(data):
+    '''(total bytes, bytes of each tag) of the tags parsed from data, with
+    their values and printable decoded, after which no version keeps the
+    data they were decoded from'''
+    tags = EXIF.process_file(StringIO(data))
+    for tag in tags.values():
+        getattr(tag, 'values', None)
+        getattr(tag, 'printable', None)
+    return deep_size(tags), dict((name, deep_size(tag))
+        for name, tag in tags.items())
+
+
+def main():
+    data = make_nef()
+    total, sizes = tag_sizes(data)
+    print 'EXIF.py: %s' % os.path.abspath(EXIF.__file__)
+    print 'file: %d bytes, MakerNote: %d bytes' % (len(data), NOTE_SIZE)
+    for name in sorted(sizes, key=sizes.get, reverse=True)[:5]:
+        print '%10d  %s' % (sizes[name], name)
+    print '%10d  all %d tags' % (total, len(sizes))
+
+
+if __name__ == '__main__':
+    main()
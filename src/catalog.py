@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+
+'''SQLite stores kept alongside the organized library'''
+
+import json
+import sqlite3
+import threading
+
+import journal
+
+# commit after this many writes
+COMMIT_EVERY = 1000
+
+
+class Database(object):
+    '''SQLite file holding the stores, safe to share between threads'''
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        # paths and EXIF strings are byte strings in whatever encoding they
+        # came in, stored and read back as such
+        self.conn.text_factory = str
+        self.lock = threading.RLock()
+        self.pending = 0
+
+    def query(self, sql, params=()):
+        '''Rows of a SELECT'''
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def write(self, sql, params=()):
+        '''Run a statement changing the database, committed in batches'''
+        with self.lock:
+            self.conn.execute(sql, params)
+            self.pending += 1
+            if self.pending >= COMMIT_EVERY:
+                self.commit()
+
+    def commit(self):
+        '''Write pending changes to disk'''
+        with self.lock:
+            self.conn.commit()
+            self.pending = 0
+
+    def close(self):
+        '''Commit and close'''
+        with self.lock:
+            self.commit()
+            self.conn.close()
+
+
+class MetadataCache(object):
+    '''EXIF fields extracted from each file, keyed by its stat signature
+
+    Entries are looked up by (device, inode), so they follow a file when it
+    is renamed or moved within a filesystem, and are only used while the
+    size and mtime still match. Fields are stored as JSON, never pickled:
+    a database anyone could write must not run code when read.'''
+
+    def __init__(self, db):
+        self.db = db
+        db.write('CREATE TABLE IF NOT EXISTS metadata ('
+            'dev INTEGER, ino INTEGER, size INTEGER, mtime REAL, '
+            'fields BLOB, PRIMARY KEY (dev, ino))')
+
+    def _lookup(self, st):
+        '''All cached fields of the file with stat st, {} if stale or missing'''
+        rows = self.db.query('SELECT size, mtime, fields FROM metadata '
+            'WHERE dev = ? AND ino = ?', (st.st_dev, st.st_ino))
+        if not rows or rows[0][0] != st.st_size or rows[0][1] != st.st_mtime:
+            return {}
+        try:
+            return journal.from_json(json.loads(str(rows[0][2])))
+        except ValueError:
+            # written by an older version, read the file again
+            return {}
+
+    def get(self, st, names):
+        '''Cached fields of the file with stat st, None unless all of names
+        are there'''
+        fields = self._lookup(st)
+        for name in names:
+            if name not in fields:
+                return None
+        return fields
+
+    def put(self, st, fields):
+        '''Store fields for the file with stat st, on top of those already
+        cached for it'''
+        with self.db.lock:
+            merged = self._lookup(st)
+            merged.update(fields)
+            self.db.write('INSERT OR REPLACE INTO metadata '
+                '(dev, ino, size, mtime, fields) VALUES (?, ?, ?, ?, ?)',
+                (st.st_dev, st.st_ino, st.st_size, st.st_mtime,
+                 sqlite3.Binary(json.dumps(journal.to_json(merged)))))
+
+
+class Catalog(object):
+    '''One row per organized file, indexed by date taken and camera'''
+
+    COLUMNS = ('path', 'original', 'taken', 'make', 'model', 'shutter_count',
+        'size', 'sha1')
+
+    def __init__(self, db):
+        self.db = db
+        db.write('CREATE TABLE IF NOT EXISTS files ('
+            'path TEXT PRIMARY KEY, original TEXT, taken TEXT, '
+            'make TEXT COLLATE NOCASE, model TEXT COLLATE NOCASE, '
+            'shutter_count INTEGER, size INTEGER, sha1 TEXT)')
+        db.write('CREATE INDEX IF NOT EXISTS files_taken ON files (taken)')
+        db.write('CREATE INDEX IF NOT EXISTS files_camera ON files '
+            '(make, model)')
+        self.added = 0
+
+    def add(self, **row):
+        '''Record an organized file, replacing any row for its path'''
+        self.added += 1
+        self.db.write('INSERT OR REPLACE INTO files (%s) VALUES (%s)' % (
+            ', '.join(self.COLUMNS), ', '.join('?' * len(self.COLUMNS))),
+            [row.get(column) for column in self.COLUMNS])
+
+    def analyze(self):
+        '''Refresh the statistics the query planner picks indexes by, after
+        rows were added'''
+        if self.added:
+            self.db.write('ANALYZE files')
+            self.added = 0
+
+    def find(self, start=None, end=None, make=None, model=None):
+        '''Rows taken between start and end, inclusive 'YYYY-MM-DD' or
+        'YYYY-MM-DD HH:MM:SS', with the given camera make and model'''
+        where, params = [], []
+        if start:
+            where.append('taken >= ?')
+            params.append(start)
+        if end:
+            # a bare date includes the whole day
+            where.append('taken <= ?')
+            params.append(end if len(end) > 10 else end + ' 23:59:59')
+        if make:
+            where.append('make = ?')
+            params.append(make)
+        if model:
+            where.append('model = ?')
+            params.append(model)
+        sql = 'SELECT %s FROM files' % ', '.join(self.COLUMNS)
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        return [dict(zip(self.COLUMNS, row))
+            for row in self.db.query(sql + ' ORDER BY taken, path', params)]
+
+
+class MirrorManifest(object):
+    '''Source (size, mtime) each compressed mirror file was written from'''
+
+    def __init__(self, db):
+        self.db = db
+        db.write('CREATE TABLE IF NOT EXISTS mirror ('
+            'mirror TEXT, source TEXT, size INTEGER, mtime REAL, '
+            'target TEXT, PRIMARY KEY (mirror, source))')
+
+    def entries(self, mirror):
+        '''{source: (size, mtime, target)} of everything in mirror'''
+        return dict((row[0], row[1:]) for row in self.db.query(
+            'SELECT source, size, mtime, target FROM mirror WHERE mirror = ?',
+            (mirror,)))
+
+    def entry(self, mirror, source):
+        '''(size, mtime, target) of source in mirror, None if not there'''
+        rows = self.db.query('SELECT size, mtime, target FROM mirror '
+            'WHERE mirror = ? AND source = ?', (mirror, source))
+        return rows[0] if rows else None
+
+    def put(self, mirror, source, st, target):
+        '''Record target as written from source with stat st'''
+        self.db.write('INSERT OR REPLACE INTO mirror '
+            '(mirror, source, size, mtime, target) VALUES (?, ?, ?, ?, ?)',
+            (mirror, source, st.st_size, st.st_mtime, target))
+
+    def remove(self, mirror, source):
+        '''Forget source'''
+        self.db.write('DELETE FROM mirror WHERE mirror = ? AND source = ?',
+            (mirror, source))
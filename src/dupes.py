@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+'''Find image files with identical contents'''
+
+import os
+import hashlib
+from collections import defaultdict
+
+# bytes read at a time when hashing
+HASH_CHUNK = 2 ** 20
+# bytes hashed from each end of a file before hashing all of it
+EDGE = 2 ** 16
+
+
+def _cached(name, compute, path, cache, st):
+    '''Field name of path, from cache when it has it, else compute(path)'''
+    if cache is None:
+        return compute(path)
+    if st is None:
+        st = os.stat(path)
+    values = cache.get(st, (name,))
+    if values is not None:
+        return values[name]
+    value = compute(path)
+    cache.put(st, {name: value})
+    return value
+
+
+def _sha1_file(path):
+    digest = hashlib.sha1()
+    pfile = open(path, 'rb')
+    try:
+        for chunk in iter(lambda: pfile.read(HASH_CHUNK), ''):
+            digest.update(chunk)
+    finally:
+        pfile.close()
+    return digest.hexdigest()
+
+
+def _sha1_edges(path):
+    digest = hashlib.sha1()
+    pfile = open(path, 'rb')
+    try:
+        digest.update(pfile.read(EDGE))
+        pfile.seek(0, os.SEEK_END)
+        pfile.seek(max(pfile.tell() - EDGE, EDGE))
+        digest.update(pfile.read(EDGE))
+    finally:
+        pfile.close()
+    return digest.hexdigest()
+
+
+def file_hash(path, cache=None, st=None):
+    '''SHA-1 hex digest of the contents of path'''
+    return _cached('SHA1', _sha1_file, path, cache, st)
+
+
+def edge_hash(path, cache=None, st=None):
+    '''SHA-1 hex digest of the first and last EDGE bytes of path, all of it
+    if that is smaller'''
+    return _cached('SHA1 edges', _sha1_edges, path, cache, st)
+
+
+def same_content(path, other, cache=None):
+    '''Whether the files path and other hold the same bytes'''
+    st, other_st = os.stat(path), os.stat(other)
+    if st.st_size != other_st.st_size:
+        return False
+    return file_hash(path, cache, st) == file_hash(other, cache, other_st)
+
+
+def find_duplicates(paths, cache=None):
+    '''Groups of paths with identical contents, each sorted, the largest
+    files first
+
+    Files are grouped by size, then by edge_hash() and only then by
+    file_hash(), so most files are never read, and most of the rest only
+    in part.  Hard links to one file count once.'''
+    by_size = defaultdict(list)
+    inodes = set()
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        if not st.st_size or (st.st_dev, st.st_ino) in inodes:
+            continue
+        inodes.add((st.st_dev, st.st_ino))
+        by_size[st.st_size].append((path, st))
+
+    groups = []
+    for size in sorted(by_size, reverse=True):
+        if len(by_size[size]) < 2:
+            continue
+        candidates = [by_size[size]]
+        # the edges of small files are the whole file
+        hashes = (edge_hash,) if size <= 2 * EDGE else (edge_hash, file_hash)
+        for hash_function in hashes:
+            candidates = _regroup(candidates, hash_function, cache)
+        groups.extend(sorted(path for path, st in group)
+            for group in candidates)
+    return groups
+
+
+def _regroup(groups, hash_function, cache):
+    '''Split groups of (path, stat) by hash_function, keeping those that
+    still hold more than one file'''
+    split = []
+    for group in groups:
+        by_hash = defaultdict(list)
+        for path, st in group:
+            try:
+                by_hash[hash_function(path, cache, st)].append((path, st))
+            except (IOError, OSError):
+                continue
+        split.extend(same for same in by_hash.itervalues() if len(same) > 1)
+    return split
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+'''Write-ahead journal of the moves and deletes of an organize run'''
+
+import os
+import json
+
+# fsync after this many completed operations
+SYNC_EVERY = 100
+
+
+def to_json(value):
+    '''value with its byte strings as latin-1 unicode, which json encodes
+    whatever bytes a path or EXIF string has'''
+    if isinstance(value, str):
+        return value.decode('latin-1')
+    if isinstance(value, dict):
+        return dict((to_json(k), to_json(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return [to_json(item) for item in value]
+    return value
+
+
+def from_json(value):
+    '''Undo to_json on what json read back, tuples come back as lists'''
+    if isinstance(value, unicode):
+        return value.encode('latin-1')
+    if isinstance(value, dict):
+        return dict((from_json(k), from_json(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return [from_json(item) for item in value]
+    return value
+
+
+class Journal(object):
+    '''Append-only file of JSON lines: every operation of a run before any
+    is applied, then the id of each one as it completes
+
+    Completions are only synced in batches, so after a crash the last few
+    done operations may still look pending; whoever resumes must check
+    those against the filesystem.'''
+
+    def __init__(self, path, before_sync=None):
+        self.path = path
+        # called before each sync, e.g. to commit what completions imply
+        self.before_sync = before_sync
+        self.jfile = None
+        self.unsynced = 0
+
+    def start(self, operations):
+        '''Record operations, numbering them with an 'id', and sync'''
+        parent = os.path.dirname(self.path)
+        if parent and not os.path.isdir(parent):
+            os.makedirs(parent)
+        self.jfile = open(self.path, 'w')
+        try:
+            for number, operation in enumerate(operations):
+                operation['id'] = number
+                self.jfile.write(json.dumps(
+                    {'operation': to_json(operation)}) + '\n')
+            self.sync()
+        except Exception:
+            # nothing was applied yet, leave no journal to resume
+            self.jfile.close()
+            os.remove(self.path)
+            raise
+
+    def reopen(self):
+        '''Continue appending to the journal of an interrupted run'''
+        self.jfile = open(self.path, 'a')
+
+    def done(self, operation):
+        '''Record operation as completed'''
+        self.jfile.write(json.dumps({'done': operation['id']}) + '\n')
+        self.unsynced += 1
+        if self.unsynced >= SYNC_EVERY:
+            self.sync()
+
+    def sync(self):
+        '''Flush completions to disk'''
+        if self.before_sync is not None:
+            self.before_sync()
+        self.jfile.flush()
+        os.fsync(self.jfile.fileno())
+        self.unsynced = 0
+
+    def close(self):
+        '''Sync and close, keeping the journal to resume from'''
+        if self.jfile is not None and not self.jfile.closed:
+            self.sync()
+            self.jfile.close()
+
+    def finish(self):
+        '''Close and delete the journal of a run that completed'''
+        self.close()
+        os.remove(self.path)
+
+    def pending(self):
+        '''Operations recorded but not marked done, in their original order,
+        with the byte strings they were started with'''
+        operations, done = [], set()
+        jfile = open(self.path)
+        try:
+            for line in jfile:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # the line being written when the run died
+                    continue
+                if 'operation' in entry:
+                    operations.append(from_json(entry['operation']))
+                elif 'done' in entry:
+                    done.add(entry['done'])
+        finally:
+            jfile.close()
+        return [operation for operation in operations
+            if operation['id'] not in done]
+
@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+
+'''Per stage counters, latency histograms and progress of a run'''
+
+import os
+import sys
+import time
+import json
+import heapq
+import threading
+import cProfile
+import pstats
+from collections import OrderedDict
+from contextlib import contextmanager
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# upper bounds in seconds of the latency histogram buckets
+BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30)
+PROMETHEUS_PREFIX = 'pyimageorg'
+# files listed per stage in the profile report
+SLOWEST_FILES = 20
+
+
+class Stage(object):
+    '''Totals and latency histogram of one stage'''
+
+    __slots__ = ('files', 'errors', 'bytes', 'seconds', 'buckets')
+
+    def __init__(self):
+        self.files = 0
+        self.errors = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.buckets = [0] * len(BUCKETS)
+
+    def observe(self, seconds, nbytes):
+        self.files += 1
+        self.bytes += nbytes
+        self.seconds += seconds
+        for number, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[number] += 1
+                break
+
+    def summary(self):
+        '''Totals and rates, as plain values'''
+        return OrderedDict([('files', self.files), ('errors', self.errors),
+            ('bytes', self.bytes), ('seconds', round(self.seconds, 6)),
+            ('files_per_second', rate(self.files, self.seconds)),
+            ('bytes_per_second', rate(self.bytes, self.seconds))])
+
+
+class Metrics(object):
+    '''Stages of a run by name, safe to update from several threads'''
+
+    def __init__(self):
+        self.started = time.time()
+        self.stages = OrderedDict()
+        self.lock = threading.Lock()
+        # set by enable_profiling()
+        self.profile_dir = None
+        self.slowest = {}
+        self.peak_rss = OrderedDict()
+        self.thread_profiles = {}
+
+    def _stage(self, name):
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = Stage()
+        return stage
+
+    def observe(self, name, seconds, nbytes=0, path=None, model=None):
+        '''Count a file through stage name that took seconds'''
+        with self.lock:
+            self._stage(name).observe(seconds, nbytes)
+            if self.profile_dir is not None and path is not None:
+                slowest = self.slowest.setdefault(name, [])
+                entry = (seconds, path, nbytes, model)
+                if len(slowest) < SLOWEST_FILES:
+                    heapq.heappush(slowest, entry)
+                else:
+                    heapq.heappushpop(slowest, entry)
+
+    def error(self, name):
+        '''Count a file stage name failed on'''
+        with self.lock:
+            self._stage(name).errors += 1
+
+    @contextmanager
+    def timed(self, name, nbytes=0, path=None):
+        '''Time the block as one file through stage name; the block may
+        set 'model' in the dict it gets for the profile report'''
+        start = time.time()
+        note = {}
+        try:
+            yield note
+        except Exception:
+            self.error(name)
+            raise
+        self.observe(name, time.time() - start, nbytes, path,
+            note.get('model'))
+
+    def timed_iter(self, name, iterable):
+        '''Items of iterable, the time taken to produce each one counted as
+        a file through stage name'''
+        iterator = iter(iterable)
+        while True:
+            start = time.time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.observe(name, time.time() - start)
+            yield item
+
+    def enable_profiling(self, directory):
+        '''Profile the phases run under profiled() into directory, and
+        note the slowest files of each stage'''
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.profile_dir = directory
+
+    @contextmanager
+    def profiled(self, phase):
+        '''Write a cProfile dump of the block, including what call() ran
+        in other threads meanwhile, to phase.pstats'''
+        if self.profile_dir is None:
+            yield
+            return
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            with self.lock:
+                others = self.thread_profiles.values()
+                self.thread_profiles = {}
+            dump = pstats.Stats(profile)
+            for other in others:
+                dump.add(other)
+            dump.dump_stats(os.path.join(self.profile_dir, phase + '.pstats'))
+            if resource is not None:
+                # kilobytes on Linux, bytes on Mac OS X
+                self.peak_rss[phase] = \
+                    resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    def call(self, function, *args):
+        '''function(*args), profiled when it runs in a worker thread during
+        a profiled() phase'''
+        if self.profile_dir is None or \
+            threading.current_thread().name == 'MainThread':
+            return function(*args)
+        ident = threading.current_thread().ident
+        with self.lock:
+            profile = self.thread_profiles.get(ident)
+            if profile is None:
+                profile = self.thread_profiles[ident] = cProfile.Profile()
+        return profile.runcall(function, *args)
+
+    def write_profile_report(self):
+        '''Write the slowest files of each stage and the peak memory after
+        each phase to report.txt in the profile dir'''
+        if self.profile_dir is None:
+            return
+        lines = []
+        for phase, rss in self.peak_rss.iteritems():
+            lines.append('peak RSS after %s: %d' % (phase, rss))
+        with self.lock:
+            for name in self.stages:
+                slowest = self.slowest.get(name)
+                if not slowest:
+                    continue
+                lines.append('')
+                lines.append('%s: %d slowest of %d files' % (name,
+                    len(slowest), self.stages[name].files))
+                lines.append('%10s %12s  %-20s %s' % ('seconds', 'bytes',
+                    'model', 'path'))
+                for seconds, path, nbytes, model in sorted(slowest,
+                    reverse=True):
+                    lines.append('%10.4f %12d  %-20s %s' % (seconds, nbytes,
+                        model or '-', path))
+        _replace(os.path.join(self.profile_dir, 'report.txt'),
+            '\n'.join(lines) + '\n')
+
+    def summary(self):
+        '''Run time and the summary of each stage'''
+        with self.lock:
+            return OrderedDict([
+                ('seconds', round(time.time() - self.started, 6)),
+                ('stages', OrderedDict((name, stage.summary())
+                    for name, stage in self.stages.iteritems()))])
+
+    def write_json(self, path):
+        '''Write summary() as JSON to path, '-' for stdout'''
+        text = json.dumps(self.summary(), indent=1) + '\n'
+        if path == '-':
+            sys.stdout.write(text)
+        else:
+            _replace(path, text)
+
+    def write_prometheus(self, path):
+        '''Write the metrics in the Prometheus text format, for the node
+        exporter's textfile collector'''
+        name = PROMETHEUS_PREFIX + '_stage_seconds'
+        lines = ['# HELP %s Time spent on each file, per stage.' % name,
+            '# TYPE %s histogram' % name]
+        with self.lock:
+            stages = self.stages.items()
+            for stage_name, stage in stages:
+                cumulative = 0
+                for bound, count in zip(BUCKETS, stage.buckets):
+                    cumulative += count
+                    lines.append('%s_bucket{stage="%s",le="%s"} %d' % (
+                        name, stage_name, bound, cumulative))
+                lines.append('%s_bucket{stage="%s",le="+Inf"} %d' % (
+                    name, stage_name, stage.files))
+                lines.append('%s_sum{stage="%s"} %f' % (name, stage_name,
+                    stage.seconds))
+                lines.append('%s_count{stage="%s"} %d' % (name, stage_name,
+                    stage.files))
+            for metric, kind, text in (
+                ('bytes', 'bytes', 'Bytes processed, per stage.'),
+                ('errors', 'errors', 'Files that failed, per stage.')):
+                full = '%s_stage_%s_total' % (PROMETHEUS_PREFIX, metric)
+                lines.append('# HELP %s %s' % (full, text))
+                lines.append('# TYPE %s counter' % full)
+                for stage_name, stage in stages:
+                    lines.append('%s{stage="%s"} %d' % (full, stage_name,
+                        getattr(stage, kind)))
+        for metric, value, text in (
+            ('run_seconds', time.time() - self.started, 'Length of the run.'),
+            ('last_run_timestamp_seconds', time.time(),
+                'When the run ended.')):
+            full = '%s_%s' % (PROMETHEUS_PREFIX, metric)
+            lines.extend(['# HELP %s %s' % (full, text),
+                '# TYPE %s gauge' % full, '%s %f' % (full, value)])
+        _replace(path, '\n'.join(lines) + '\n')
+
+
+class Progress(object):
+    '''Periodic "done/total, rate, ETA" lines on stderr'''
+
+    def __init__(self, label, total, interval):
+        self.label = label
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.started = self.last = time.time()
+
+    def tick(self, count=1):
+        '''Count files done, printing a line at most every interval'''
+        self.done += count
+        now = time.time()
+        if self.interval and now - self.last >= self.interval:
+            self.last = now
+            sys.stderr.write(self.line(now) + '\n')
+
+    def line(self, now=None):
+        '''The progress line'''
+        elapsed = (now or time.time()) - self.started
+        speed = rate(self.done, elapsed)
+        eta = '?'
+        if speed and self.total >= self.done:
+            eta = format_seconds((self.total - self.done) / speed)
+        return '%s: %d/%d files, %.1f files/s, ETA %s' % (self.label,
+            self.done, self.total, speed, eta)
+
+
+def rate(count, seconds):
+    '''count per second, 0 if no time passed'''
+    if seconds <= 0:
+        return 0.0
+    return round(count / seconds, 3)
+
+
+def format_seconds(seconds):
+    '''H:MM:SS'''
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '%d:%02d:%02d' % (hours, minutes, seconds)
+
+
+def _replace(path, text):
+    '''Write text to path atomically, so readers never see half of it'''
+    partial = path + '.%d.tmp' % os.getpid()
+    pfile = open(partial, 'w')
+    try:
+        pfile.write(text)
+    finally:
+        pfile.close()
+    os.rename(partial, path)
@@ -4,25 +4,244 @@
 
 import sys
 import os
-from os.path import join, getsize, basename, dirname, exists
+from os.path import join, basename, dirname, exists, isdir
 #from optparse import OptionParser
 import argparse
 import fnmatch
+import re
+import stat
 import shutil
-from errno import EEXIST
+from errno import EEXIST, EXDEV
 import logging
+import time
+import json
+import signal
 import ConfigParser
-import filecmp
+from cStringIO import StringIO
+from collections import deque, namedtuple, OrderedDict
+from itertools import islice
 import EXIF
-import Image
+import catalog
+import dupes
+import journal
+import metrics
 from pprint import pprint
+# PIL (Image), multiprocessing and watch are slow to import and most runs
+# need none of them, they are imported where first used
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
 
 foobar = None
+# per stage metrics of this run
+stats = metrics.Metrics()
 
 VALID_GLOB = ('*.JPG', '*.jpg', '*.nef', '*.NEF', '*.dng', '*.DNG')
 IGNORE_GLOB = ('.*', '_*')
+# raw formats, mirrored from their embedded JPEG preview
+RAW_EXTENSIONS = ('.nef', '.dng')
 RENAME_FORMAT = "%(YYYY)s%(MM)s%(DD)s-%(HH)s%(mm)s%(SS)s%(MakerNoteTotalShutterReleases)s"
 ORGANIZED_DIR_FORMAT = "%(YYYY)s/%(MM)s/%(DD)s"
+# EXIF tags needed to rename and organize a file
+EXIF_TAGS = ('EXIF DateTimeOriginal', 'MakerNote TotalShutterReleases',
+    'Image Make', 'Image Model')
+# EXIF tags needed to mirror a raw file
+PREVIEW_TAGS = ('JPEGPreview',)
+# bytes copied at a time when moving across filesystems
+COPY_CHUNK = 2 ** 20
+# metadata cache and catalog, in organized_dir unless --db says otherwise
+CACHE_FILE = '.pyimageorg.db'
+# journal of the moves of an organize run, in organized_dir
+JOURNAL_FILE = '.pyimageorg.journal'
+
+
+def compile_globs(globs):
+    '''One regex matching a name against any of the shell patterns globs'''
+    return re.compile('|'.join(fnmatch.translate(glob) for glob in globs))
+
+VALID_MATCH = compile_globs(VALID_GLOB).match
+IGNORE_MATCH = compile_globs(IGNORE_GLOB).match
+
+
+def _list_dir(path):
+    '''(name, is_file, is_dir) of the entries of path; symlinks to
+    directories are neither, like os.walk they are not followed'''
+    if scandir is not None:
+        # file types come from the directory listing, no stat per entry
+        for entry in scandir(path):
+            if entry.is_dir(follow_symlinks=False):
+                yield entry.name, False, True
+            else:
+                yield entry.name, not entry.is_dir(), False
+        return
+    for name in os.listdir(path):
+        mode = os.lstat(join(path, name)).st_mode
+        if stat.S_ISDIR(mode):
+            yield name, False, True
+        else:
+            yield name, not (stat.S_ISLNK(mode) and isdir(join(path, name))), \
+                False
+
+
+def walk_images(top):
+    '''(root, name) of the image files under top, top-down in os.walk
+    order, streamed as the directories are read'''
+    subdirs = []
+    count = 0
+    try:
+        for name, is_file, is_dir in _list_dir(top):
+            if is_dir:
+                subdirs.append(name)
+            elif is_file:
+                count += 1
+                log.debug(('curr_file', name))
+                if IGNORE_MATCH(name):
+                    log.debug('skipping')
+                elif VALID_MATCH(name):
+                    yield top, name
+    except OSError, ex:
+        log.warning(('Cannot list', top, ex))
+    log.info('%s: %d non-directory files' % (top, count))
+    for name in subdirs:
+        for found in walk_images(join(top, name)):
+            yield found
+
+
+def exif_values(tags, names):
+    '''Plain values of the EXIF tags names, None for missing ones'''
+    values = {}
+    for name in names:
+        tag = tags.get(name)
+        if isinstance(tag, EXIF.Thumbnail):
+            values[name] = (tag.offset, tag.length)
+        elif tag is None or isinstance(tag.values, str):
+            values[name] = tag and tag.values
+        else:
+            values[name] = list(tag.values)
+    return values
+
+
+def read_exif(path, names, cache=None, st=None):
+    '''Values of the EXIF tags names of path, from cache when it has them'''
+    if cache is not None:
+        if st is None:
+            st = os.stat(path)
+        values = cache.get(st, names)
+        if values is not None:
+            return values
+    with stats.timed('open'):
+        pfile = open(path, 'rb')
+    try:
+        with stats.timed('exif', st.st_size if st else 0, path) as note:
+            values = exif_values(EXIF.process_file(pfile, tags=names), names)
+            note['model'] = values.get('Image Model')
+    finally:
+        pfile.close()
+    if cache is not None:
+        cache.put(st, values)
+    return values
+
+
+def listed_images(top, name, listed=False):
+    '''walk_images(top) timed as the stage name; walked up front into a
+    list when listed, so progress can count it without a second walk'''
+    found = stats.timed_iter(name, walk_images(top))
+    return list(found) if listed else found
+
+
+def partial_path(dest):
+    '''Temporary name dest is copied to when moving across filesystems'''
+    # dot names are in IGNORE_GLOB, a leftover is never picked up
+    return join(dirname(dest), '.%s.part' % basename(dest))
+
+
+def move_file(source, dest):
+    '''Move source to dest with a single rename, or across filesystems by
+    copying to a temporary name next to dest and renaming that; never
+    replaces an existing dest'''
+    if os.path.lexists(dest):
+        raise OSError(EEXIST, 'Destination path %s already exists' % dest)
+    try:
+        os.rename(source, dest)
+        return
+    except OSError as ex:
+        if ex.errno != EXDEV:
+            raise
+    partial = partial_path(dest)
+    start = time.time()
+    try:
+        src = open(source, 'rb')
+        try:
+            dst = open(partial, 'wb')
+            try:
+                shutil.copyfileobj(src, dst, COPY_CHUNK)
+                dst.flush()
+                os.fsync(dst.fileno())
+                copied = dst.tell()
+            finally:
+                dst.close()
+        finally:
+            src.close()
+        shutil.copystat(source, partial)
+        os.rename(partial, dest)
+    except Exception:
+        stats.error('copy')
+        if os.path.lexists(partial):
+            os.remove(partial)
+        raise
+    os.remove(source)
+    stats.observe('copy', time.time() - start, copied)
+
+
+def open_database(path, organized_dir, dry_run=False):
+    '''Open the database of the metadata cache and catalog, None if
+    unavailable'''
+    path = path or join(organized_dir or '', CACHE_FILE)
+    try:
+        if dirname(path) and not exists(dirname(path)) and not dry_run:
+            os.makedirs(dirname(path))
+        return catalog.Database(path)
+    except Exception as ex:
+        log.warning(('Database unavailable', path, ex))
+        return None
+
+
+def open_image(source_image, preview=None):
+    '''Open image, or the JPEG preview at (offset, length) inside it'''
+    import Image
+    if preview is None:
+        return Image.open(source_image)
+    offset, length = preview
+    pfile = open(source_image, 'rb')
+    try:
+        pfile.seek(offset)
+        return Image.open(StringIO(pfile.read(length)))
+    finally:
+        pfile.close()
+
+
+def write_compressed(job):
+    '''Write a copy of an image scaled down to size, return (target_file,
+    None or the exception raised, seconds taken); runs in mirror worker
+    processes'''
+    source_image, preview, target_file, size = job
+    start = time.time()
+    try:
+        # a missing or broken PIL, as open_image meets it too, is this
+        # job's error like any other
+        import Image
+        target_img = open_image(source_image, preview)
+        # let the JPEG decoder scale down while decoding
+        target_img.draft('RGB', size)
+        target_img.thumbnail(size, Image.ANTIALIAS)
+        target_img.save(target_file)
+    except Exception as ex:
+        return target_file, ex, time.time() - start
+    return target_file, None, time.time() - start
 
 
 def init_logging(level='debug', log_file='', log_dir='.'):
@@ -82,6 +301,13 @@ class CommandLineParameters(object):
         self.parser.add_argument('-o', '--overwrite', action='store_true')
         self.parser.add_argument('-q', '--queue-errors', action='store_true',
             default=True, help='Queue errors instead of stopping on them')
+        self.parser.add_argument('--db', '--cache', action='store', dest='db',
+            help='Metadata cache and catalog file (default: ORGANIZED_DIR/%s)'
+            % CACHE_FILE)
+        self.parser.add_argument('--no-cache', action='store_true',
+            help='Always read EXIF from the files')
+        self.parser.add_argument('--workers', action='store', type=int,
+            default=1, help='Threads reading EXIF ahead of the renames')
 
         # Organizing options
         case_group = self.parser.add_mutually_exclusive_group()
@@ -100,6 +326,8 @@ class CommandLineParameters(object):
         self.parser.add_argument('--compressed-dimension', action='store',
             type=int, default=1600,
             help='Square dimension of compression.  800 for example compresses to 800x800')
+        self.parser.add_argument('--mirror-workers', action='store', type=int,
+            default=1, help='Processes compressing mirror images')
 
         # EXIF tags
         self.parser.add_argument('--exif-dimension', action='store', type=int,
@@ -107,6 +335,33 @@ class CommandLineParameters(object):
         # Unknown options
         self.parser.add_argument('-c', '--confirm-every', action='store_true', help='Confirm every action')
         self.parser.add_argument('--confirm-once', action='store_true', help='Confirm all renames once')
+        self.parser.add_argument('--resume', action='store_true',
+            help='Finish the interrupted run journaled in ORGANIZED_DIR '
+            'instead of scanning source_folder')
+        self.parser.add_argument('--watch', action='store_true',
+            help='Keep running, organizing (and mirroring) files as they are '
+            'written into source_folder')
+        self.parser.add_argument('--settle', action='store', type=float,
+            default=2.0, metavar='SECONDS',
+            help='With --watch, seconds a file without a close event must '
+            'keep its size to count as written')
+        self.parser.add_argument('--poll', action='store', type=float,
+            default=5.0, metavar='SECONDS',
+            help='With --watch where inotify is unavailable, scan '
+            'source_folder every SECONDS')
+        self.parser.add_argument('--progress', action='store', type=int,
+            default=0, metavar='SECONDS',
+            help='Print progress and ETA to stderr every SECONDS')
+        self.parser.add_argument('--metrics-file', action='store',
+            help='Write per stage metrics to a Prometheus textfile at the end')
+        self.parser.add_argument('--summary', action='store',
+            help='Write per stage metrics as JSON at the end, - for stdout')
+        self.parser.add_argument('--profile', action='store', metavar='DIR',
+            help='Write cProfile dumps of each phase and a report of the '
+            'slowest files of each stage to DIR')
+        self.parser.add_argument('--plan', action='store',
+            help='Write the planned renames as JSON to PLAN (stdout on --dry-run), '
+            'strings holding the bytes of paths and EXIF values as latin-1')
         self.parser.add_argument('-p', '--delete-dupes', action='store_true', help='delete duplicates (source)')
         
         self.parser.add_argument('source_folder', nargs='?')
@@ -119,12 +374,14 @@ class CommandLineParameters(object):
         # Validate required parameters
         if self.args.get('source_folder') is None:
             # some options don't need the base parameter
-            if self.args.get('compressed_mirror'):
+            if self.args.get('resume'):
+                pass
+            elif self.args.get('compressed_mirror'):
                 self.skip_processfiles = True
                 print 'Skipping Processed Files'
             else:
                 print 'Not Skipping Processed Files'
-            if not self.skip_processfiles:
+            if not (self.skip_processfiles or self.args.get('resume')):
                 print(('Invalid number of parameters:', self.args))
                 sys.exit(1)
 
@@ -134,6 +391,15 @@ class CommandLineParameters(object):
             pprint(self.args)
             sys.exit(1)
 
+        if self.args.get('watch') and (self.args.get('source_folder') is None
+            or self.args.get('resume')):
+            print('--watch requires source_folder and conflicts with --resume')
+            sys.exit(1)
+
+        if self.args.get('workers') < 1 or self.args.get('mirror_workers') < 1:
+            print('Invalid number of workers')
+            sys.exit(1)
+
         # Validate organizing options
         if self.args.get('upper_case_ext') and self.args.get('lower_case_ext'):
             print('Upper and Lower case are conflicting options.')
@@ -168,41 +434,123 @@ class OrganizeFiles(object):
         pass
 
 
+# one file on its way through the organize stages, scan -> parse -> name ->
+# plan; each stage yields a new record with its fields filled in, error is
+# what stopped the file, if anything
+ImageFile = namedtuple('ImageFile', 'source tags fields target error')
+
+
 class ProcessFiles(object):
     '''Process image files'''
 
-    def __init__(self, cmd_line):
+    def __init__(self, cmd_line, cache=None, catalog=None, files=None):
         log.debug('Processing Files')
         self.cmd_line = cmd_line
-        self.new_name = None
-        self.dto = {}
-        self.target = None
-        self.dto_str = None
-        self.folder = None
-        self._walk()
+        self.cache = cache
+        self.catalog = catalog
+        # paths to process instead of walking source_folder
+        self.files = files
+        # targets moved into organized_dir this run
+        self.moved = []
+        self.operations = []
+        # names in each destination dir, listed once
+        self.listings = {}
+        # source planned to move to each target
+        self.planned = {}
+        self.journal = journal.Journal(
+            join(self.cmd_line.args.get('organized_dir'), JOURNAL_FILE),
+            catalog and catalog.db.commit)
+        if self.cmd_line.args.get('resume'):
+            with stats.profiled('execute'):
+                self._resume()
+            return
+        if exists(self.journal.path) and not self.cmd_line.args.get('dry_run'):
+            log.warning('Replacing the journal of an unfinished run, '
+                '--resume would have finished it')
+        with stats.profiled('plan'):
+            self._walk()
+        self._emit_plan()
+        if not self.cmd_line.args.get('dry_run') and self._confirm():
+            with stats.profiled('execute'):
+                self._execute()
 
     def _walk(self):
-        '''Walk the path'''
+        '''Plan every file, streaming records through the stages'''
 
-        for root, dirs, files in os.walk(self.cmd_line.args.get('source_folder')):
-            consume = sum(getsize(join(root, name)) \
-                for name in files) / (2 ** 20)
-            log.info(root + 'consumes' + str(consume) + 'M in' +
-                str(len(files)) + 'non-directory files')
-            for curr_file in files:
-                if self.cmd_line.args.get('verbose'):
-                    log.debug(('curr_file', curr_file))
-                skip = False
-                for match in IGNORE_GLOB:
-                    if fnmatch.fnmatch(curr_file, match):
-                        skip = True
-                if skip:
-                    log.debug('skipping')
-                    continue
-                for match in VALID_GLOB:
-                    if fnmatch.fnmatch(curr_file, match):
-                        self._process_current(join(root, curr_file))
+        workers = self.cmd_line.args.get('workers') or 1
+        interval = self.cmd_line.args.get('progress')
+        found = None
+        if self.files is not None:
+            progress = self._progress('plan', total=len(self.files))
+        else:
+            found = listed_images(self.cmd_line.args.get('source_folder'),
+                'walk', bool(interval))
+            progress = self._progress('plan',
+                total=len(found) if interval else 0)
+        pool = None
+        if workers > 1:
+            # read EXIF in a thread pool, plan in walk order here
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(workers)
+        try:
+            # one operation per file
+            for operation in self._plan(self._name(self._parse(
+                self._scan(found), pool, 16 * workers))):
+                progress.tick()
+                self.operations.append(operation)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+    def _scan(self, found):
+        '''Records of the files to process, in walk order; those of found,
+        the (root, name) listed_images gives, unless self.files is set'''
+
+        if self.files is not None:
+            for curr_file in self.files:
+                yield ImageFile(curr_file, None, None, None, None)
+            return
+        for root, curr_file in found:
+            yield ImageFile(join(root, curr_file), None, None, None, None)
+
+    def _parse(self, records, pool=None, chunk_size=1):
+        '''records with their EXIF tags read, in order; by the threads of
+        pool if given, in chunks of chunk_size with at most two at a time
+        in flight'''
 
+        if pool is None:
+            for record in records:
+                yield self._read_tags(record)
+            return
+        records = iter(records)
+        pending = deque()
+        while True:
+            chunk = list(islice(records, chunk_size))
+            if chunk:
+                pending.append(pool.map_async(
+                    lambda record: stats.call(self._read_tags, record), chunk))
+            if not pending:
+                return
+            if len(pending) > 1 or not chunk:
+                for record in pending.popleft().get():
+                    yield record
+
+    def _progress(self, label, total=0):
+        '''Progress of a phase over total files'''
+        return metrics.Progress(label, total,
+            self.cmd_line.args.get('progress'))
+
+    def _read_tags(self, record):
+        '''record with the EXIF tags of its file, or the exception reading
+        them raised'''
+        curr_file = record.source
+        try:
+            tags = read_exif(curr_file, EXIF_TAGS, self.cache,
+                os.stat(curr_file))
+            return record._replace(tags=tags)
+        except Exception, ex:
+            return record._replace(error=ex)
 
     def _get_extension(self, curr_file):
         '''Get/convert current file extension'''
@@ -218,14 +566,11 @@ class ProcessFiles(object):
             extension = extension.lower()
         return extension
 
-    def _extract_tags(self, tags):
-        return tags
-
     def _get_MakerNoteTotalShutterReleases(self, curr_file, tags):
         try:
-            mtsr = tags.get('MakerNote TotalShutterReleases').values[0]
-        except AttributeError, ex:
-            log.error(('Attribute error', ex, curr_file))
+            mtsr = tags.get('MakerNote TotalShutterReleases')[0]
+        except TypeError, ex:
+            log.error(('No TotalShutterReleases', curr_file))
             if not self.cmd_line.args.get('queue_errors'):
                 sys.exit(1)
             return ''
@@ -237,15 +582,17 @@ class ProcessFiles(object):
                 raise
         return '-%d' % mtsr
 
-    def _format_filename(self, curr_file, tags):
-        '''Format time'''
+    def _format_fields(self, curr_file, tags):
+        '''Fields of RENAME_FORMAT and ORGANIZED_DIR_FORMAT'''
 
 #        for (k, v) in tags.iteritems():
 #            if ('MakerNote' in k) and ('Shutter' in k):
 #                print (k, v)
 
         try:
-            self.dto_str = tags.get('EXIF DateTimeOriginal').values
+            dto_str = tags.get('EXIF DateTimeOriginal')
+            if dto_str is None:
+                raise AttributeError('No DateTimeOriginal')
         except AttributeError, ex:
             log.error(('Attribute error', ex, curr_file))
             if not self.cmd_line.args.get('queue_errors'):
@@ -260,107 +607,302 @@ class ProcessFiles(object):
             else:
                 raise
 
-        self.dto['MakerNoteTotalShutterReleases'] = self._get_MakerNoteTotalShutterReleases(curr_file, tags)
-        self.dto['date'], self.dto['time'] = self.dto_str.split(' ')
-        self.dto['YYYY'], self.dto['MM'], self.dto['DD'] = \
-            self.dto['date'].split(':')
-        self.dto['HH'], self.dto['mm'], self.dto['SS'] = \
-            self.dto['time'].split(':')
-        #self.dto['SST'] = self.sst_str
-        self.new_name = RENAME_FORMAT % self.dto
-        self.new_name = self.new_name + self._get_extension(curr_file)
+        dto = {}
+        dto['MakerNoteTotalShutterReleases'] = self._get_MakerNoteTotalShutterReleases(curr_file, tags)
+        dto['date'], dto['time'] = dto_str.split(' ')
+        dto['YYYY'], dto['MM'], dto['DD'] = dto['date'].split(':')
+        dto['HH'], dto['mm'], dto['SS'] = dto['time'].split(':')
+        #dto['SST'] = self.sst_str
+        return dto
 
     def _queue_quit(self):
         if not self.cmd_line.args.get('queue_errors'):
             sys.exit(1)
 
-    def _format_dirname(self, curr_dir, tags):
-        self.organized_dir = join(self.cmd_line.args.get('organized_dir'),
-            ORGANIZED_DIR_FORMAT % self.dto)
-        log.debug(('organized_dir', self.organized_dir))
+    def _name(self, records):
+        '''records with their target in organized_dir'''
 
-    def _process_current(self, curr_file):
-        '''Process current file'''
+        for record in records:
+            if record.error is not None:
+                yield record
+                continue
+            try:
+                fields = self._format_fields(record.source, record.tags)
+                new_name = RENAME_FORMAT % fields + \
+                    self._get_extension(record.source)
+                organized_dir = join(self.cmd_line.args.get('organized_dir'),
+                    ORGANIZED_DIR_FORMAT % fields)
+                log.debug(('organized_dir', organized_dir))
+                yield record._replace(fields=fields,
+                    target=join(organized_dir, new_name))
+            except Exception, ex:
+                yield record._replace(error=ex)
 
-        try:
-            pfile = open(curr_file, 'rb')
-            self.tags = self._extract_tags(EXIF.process_file(pfile))
-            pfile.close()
-            self._format_filename(curr_file, self.tags)
-            self._format_dirname(dirname(curr_file), self.tags)
-            self.folder = dirname(curr_file)
-            self.target = join(self.folder, self.new_name)
-            log.debug(('process_current', curr_file, self.target))
-            self._process_current_do(curr_file)
-            self._move_current()
-        except Exception, ex:
-            log.error(('Skipped rename', self.target, ex))
+    def _plan(self, records):
+        '''Operations of records, in order'''
 
-    def _process_current_do(self, curr_file):
-        if not self.cmd_line.args.get('dry_run'):
+        for record in records:
             try:
-                os.rename(curr_file, self.target)
+                if record.error is not None:
+                    raise record.error
+                log.debug(('process_current', record.source, record.target))
+                yield self._operation(record)
             except Exception, ex:
-                log.error(('Rename Failed', ex))
-                if not self.cmd_line.args.get('queue_errors'):
-                    sys.exit(1)
-                else:
-                    raise
-
-    def _move_current(self):
-        '''Move file'''
-        log.debug(('curr_file_move', self.target,
-            join(self.organized_dir, self.new_name)))
-
-        log.debug('Creating target dir')
-        if not self.cmd_line.args.get('dry_run'):
-            try:
-                os.makedirs(self.organized_dir)
-            except Exception, (errno, ex):
-                if errno in [17]:
-                    pass
-                else:
-                    log.critical(('makedirs failed', errno, ex))
-                    sys.exit(2)
+                log.error(('Skipped rename', record.target, ex))
+                yield {'action': 'skip', 'source': record.source,
+                    'target': record.target, 'reason': str(ex)}
 
-        if not self.cmd_line.args.get('dry_run'):
+    def _listing(self, path):
+        '''Names in the dir path, read once per run'''
+        if path not in self.listings:
             try:
-                shutil.move(self.target, self.organized_dir)
-            except shutil.Error as exc:
-                if 'already exists' in str(exc):
-                    if self.cmd_line.args.get('overwrite'):
-                        if filecmp.cmp(self.target,
-                            join(self.organized_dir, self.new_name)):
-                            if self.cmd_line.args.get('delete_dupes'):
-                                try:
-                                    os.remove(self.target)
-                                except Exception, ex:
-                                    log.critical((self.target, ex))
-                                    sys.exit()
-                        else:
-                            log.error((self.target, 'and',
-                                join(self.organized_dir, self.new_name),
-                                'differ'))
-                            self._queue_quit()
+                self.listings[path] = set(os.listdir(path))
+            except OSError:
+                self.listings[path] = set()
+        return self.listings[path]
+
+    def _operation(self, record):
+        '''Operation taking the file of record to its target, checked
+        against the files already there and those planned to go there'''
+        curr_file, target = record.source, record.target
+        operation = {'action': 'move', 'source': curr_file, 'target': target}
+        other = self.planned.get(target)
+        if other is None and \
+            basename(target) in self._listing(dirname(target)):
+            if os.path.samefile(curr_file, target):
+                log.debug('Already in place: %s' % target)
+                operation.update(action='skip', reason='in place')
+                return operation
+            other = target
+        if other is None:
+            self.planned[target] = curr_file
+            operation['catalog'] = self._catalog_record(record)
+            return operation
+
+        if not self.cmd_line.args.get('overwrite'):
+            log.warn('Destination path %s already exists' % target)
+            operation.update(action='skip', reason='exists')
+        elif dupes.same_content(curr_file, other, self.cache):
+            if self.cmd_line.args.get('delete_dupes'):
+                operation.update(action='delete', reason='duplicate')
+            else:
+                operation.update(action='skip', reason='duplicate')
+        else:
+            log.error((curr_file, 'and', other, 'differ'))
+            self._queue_quit()
+            operation.update(action='skip', reason='differs')
+        return operation
+
+    def _catalog_record(self, record):
+        '''Catalog row of the file of record, planned to move to its
+        target'''
+        if self.catalog is None:
+            return None
+        tags = record.tags
+        size = sha1 = None
+        if not self.cmd_line.args.get('dry_run'):
+            # only files that move are hashed, the cache keeps reruns free
+            st = os.stat(record.source)
+            with stats.timed('hash', st.st_size):
+                sha1 = dupes.file_hash(record.source, self.cache, st)
+            size = st.st_size
+        shutter_count = tags.get('MakerNote TotalShutterReleases')
+        return dict(path=os.path.abspath(record.target),
+            original=os.path.abspath(record.source),
+            taken='%(YYYY)s-%(MM)s-%(DD)s %(HH)s:%(mm)s:%(SS)s' %
+                record.fields,
+            make=(tags.get('Image Make') or '').strip() or None,
+            model=(tags.get('Image Model') or '').strip() or None,
+            shutter_count=shutter_count and shutter_count[0],
+            size=size, sha1=sha1)
+
+    def _emit_plan(self):
+        '''Write the plan as JSON to --plan, or to stdout on a dry run'''
+        path = self.cmd_line.args.get('plan')
+        if not path and not self.cmd_line.args.get('dry_run'):
+            return
+        # paths and EXIF strings are bytes in any encoding, written as latin-1
+        plan = {'operations': journal.to_json(self.operations)}
+        if not path:
+            json.dump(plan, sys.stdout, indent=1, sort_keys=True)
+            print
+            return
+        pfile = open(path, 'w')
+        try:
+            json.dump(plan, pfile, indent=1, sort_keys=True)
+        finally:
+            pfile.close()
+
+    def _confirm(self):
+        '''Show the plan and ask once whether to apply it, with
+        --confirm-once'''
+        if not self.cmd_line.args.get('confirm_once'):
+            return True
+        count = 0
+        for operation in self.operations:
+            if operation['action'] == 'move':
+                print '%(source)s -> %(target)s' % operation
+            elif operation['action'] == 'delete':
+                print 'delete %(source)s, same as %(target)s' % operation
+            else:
+                continue
+            count += 1
+        if not count:
+            return False
+        answer = raw_input('Apply %d operations? [y/N] ' % count)
+        return answer.strip().lower() in ('y', 'yes')
+
+    def _execute(self):
+        '''Apply the plan, journaling every operation before any is applied'''
+        operations = [operation for operation in self.operations
+            if operation['action'] in ('move', 'delete')]
+        # the journal may be replayed from another working dir
+        for operation in operations:
+            operation['source'] = os.path.abspath(operation['source'])
+            operation['target'] = os.path.abspath(operation['target'])
+        self.journal.start(operations)
+        self._run(operations)
+
+    def _resume(self):
+        '''Finish the operations the journal has not seen completed'''
+        if not exists(self.journal.path):
+            log.critical(('No journal to resume', self.journal.path))
+            sys.exit(1)
+        operations = self.journal.pending()
+        log.info('Resuming %d operations' % len(operations))
+        self.journal.reopen()
+        self._run([operation for operation in operations
+            if not self._completed(operation)])
+
+    def _completed(self, operation):
+        '''Whether the interrupted run got operation done before its
+        completion was synced; journals it if so'''
+        source, target = operation['source'], operation['target']
+        if operation['action'] == 'delete':
+            done = not os.path.lexists(source)
+        elif not os.path.lexists(source):
+            done = True
+            if os.path.lexists(target):
+                if operation.get('catalog'):
+                    self.catalog.add(**operation['catalog'])
+            else:
+                log.error(('Source and target missing', source, target))
+        elif os.path.lexists(target) and \
+            not os.path.samefile(source, target) and \
+            dupes.same_content(source, target):
+            # copied across filesystems, died before removing the source
+            os.remove(source)
+            if operation.get('catalog'):
+                self.catalog.add(**operation['catalog'])
+            done = True
+        else:
+            done = False
+            if os.path.lexists(partial_path(target)):
+                os.remove(partial_path(target))
+        if done:
+            self.journal.done(operation)
+        return done
+
+    def _run(self, operations):
+        '''Apply operations, one destination dir at a time'''
+        by_dir = OrderedDict()
+        for operation in operations:
+            by_dir.setdefault(dirname(operation['target']),
+                []).append(operation)
+        progress = self._progress('execute', total=len(operations))
+        completed = False
+        try:
+            for path, group in by_dir.iteritems():
+                log.debug('Creating target dir')
+                start = time.time()
+                try:
+                    os.makedirs(path)
+                except Exception, (errno, ex):
+                    if errno in [17]:
+                        pass
                     else:
-                        log.warn(exc)
-            except Exception as exc:
+                        log.critical(('makedirs failed', errno, ex))
+                        sys.exit(2)
+                stats.observe('mkdir', time.time() - start)
+                for operation in group:
+                    if self._apply(operation):
+                        self.journal.done(operation)
+                    progress.tick()
+            completed = True
+        finally:
+            if completed:
+                self.journal.finish()
+            else:
+                self.journal.close()
+
+    def _apply(self, operation):
+        '''Carry out one planned move or delete, True if it was'''
+        source, target = operation['source'], operation['target']
+        if operation['action'] == 'delete':
+            # the file it duplicates may have failed to move there
+            if not os.path.lexists(target):
+                log.error(('Keeping duplicate, original missing', source,
+                    target))
+                return False
+            try:
+                with stats.timed('delete'):
+                    os.remove(source)
+            except Exception, ex:
+                log.critical((source, ex))
+                sys.exit()
+            return True
+        record = operation.get('catalog') or {}
+        try:
+            with stats.timed('move', record.get('size') or 0, source) as note:
+                note['model'] = record.get('model')
+                move_file(source, target)
+        except EnvironmentError as exc:
+            if exc.errno == EEXIST:
+                log.warn(exc.strerror)
+            else:
                 log.error(('move failed', exc))
                 self._queue_quit()
-            else:
-                log.debug('Moved %s to %s' % (self.target, join(self.organized_dir, self.new_name)))
+            return False
+        log.debug('Moved %s to %s' % (source, target))
+        self.moved.append(target)
+        if operation.get('catalog'):
+            self.catalog.add(**operation['catalog'])
+        return True
 
 class CompressedMirror(object):
     '''Maintain a compressed mirror for easily uploading'''
 
-    def __init__(self, cmd_line):
+    def __init__(self, cmd_line, cache=None, manifest=None, files=None):
         self.cmd_line = cmd_line
+        self.cache = cache
+        self.manifest = manifest
+        # organized files to mirror instead of walking organized_dir
+        self.files = files
         self.compressed_mirror = self.cmd_line.args.get('compressed_mirror')
+        self.mirror_key = os.path.abspath(self.compressed_mirror)
+        # mirror files of the sources seen this run, never orphans
+        self.targets = set()
+        # mirror files replaced by one under a new name
+        self.replaced = []
         self._setup_path(self.compressed_mirror)
         self.size = (self.cmd_line.args.get('compressed_dimension'),
                 self.cmd_line.args.get('compressed_dimension'))
         log.debug('size: ' + str(self.size))
-        self._walk()
+        self.pool = None
+        self.pending = deque()
+        workers = self.cmd_line.args.get('mirror_workers') or 1
+        if workers > 1 and not self.cmd_line.args.get('dry_run'):
+            from multiprocessing import Pool
+            self.pool = Pool(workers)
+            # bound the queued jobs, and the result backlog with them
+            self.max_pending = 2 * workers
+        try:
+            with stats.profiled('mirror'):
+                self._walk()
+        finally:
+            if self.pool is not None:
+                self.pool.close()
+                self.pool.join()
 
     def _setup_path(self, path):
         log.debug('begin')
@@ -376,28 +918,77 @@ class CompressedMirror(object):
         '''Walk the path'''
         log.debug('begin')
         log.debug('organized_dir:' + self.cmd_line.args.get('organized_dir'))
-        for root, dirs, files in os.walk(self.cmd_line.args.get('organized_dir')):
-            consume = sum(getsize(join(root, name)) \
-                for name in files) / (2 ** 20)
-            log.info(root + 'consumes' + str(consume) + 'M in' +
-                str(len(files)) + 'non-directory files')
-            for curr_file in files:
-                if self.cmd_line.args.get('verbose'):
-                    log.debug(('curr_file', curr_file))
-                skip = False
-                for match in IGNORE_GLOB:
-                    if fnmatch.fnmatch(curr_file, match):
-                        skip = True
-                if skip:
-                    log.debug('skipping')
-                    continue
-                for match in VALID_GLOB:
-                    if fnmatch.fnmatch(curr_file, match):
-                        self._compress_current(root, curr_file)
-
-    def _compress_current(self, root, curr_file):
+        if self.files is not None:
+            self._compress_files()
+            return
+        organized_dir = self.cmd_line.args.get('organized_dir')
+        mirrored = {}
+        if self.manifest is not None:
+            # sources outside this walk, e.g. of a run on another or a
+            # wider organized_dir, are not for this run to call deleted
+            top = join(os.path.abspath(organized_dir), '')
+            mirrored = dict((source, entry) for source, entry in
+                self.manifest.entries(self.mirror_key).iteritems()
+                if source.startswith(top))
+        interval = self.cmd_line.args.get('progress')
+        found = listed_images(organized_dir, 'mirror_walk', bool(interval))
+        progress = metrics.Progress('mirror',
+            len(found) if interval else 0, interval)
+        for root, curr_file in found:
+            self._compress_current(root, curr_file, mirrored.pop(
+                os.path.abspath(join(root, curr_file)), None))
+            progress.tick()
+        self._drain(0)
+        # what is left in mirrored was deleted from organized_dir
+        for source, (size, mtime, target) in mirrored.iteritems():
+            self._remove_orphan(target)
+            if not self.cmd_line.args.get('dry_run'):
+                self.manifest.remove(self.mirror_key, source)
+        for target in self.replaced:
+            self._remove_orphan(target)
+
+    def _compress_files(self):
+        '''Bring the mirror files of self.files up to date, leaving the rest
+        of the mirror alone'''
+        for source_image in self.files:
+            mirrored = None
+            if self.manifest is not None:
+                mirrored = self.manifest.entry(self.mirror_key,
+                    os.path.abspath(source_image))
+            self._compress_current(dirname(source_image),
+                basename(source_image), mirrored)
+        self._drain(0)
+        for target in self.replaced:
+            self._remove_orphan(target)
+
+    def _remove_orphan(self, target):
+        '''Delete a mirror file no source maps to anymore'''
+        if target in self.targets:
+            return
+        log.debug('Removing orphan: %s' % target)
+        if self.cmd_line.args.get('dry_run'):
+            return
+        try:
+            os.remove(target)
+        except OSError as ex:
+            if exists(target):
+                log.error(('remove failed', target, ex))
+
+    def _record(self, source_image, st, target_file):
+        '''Note in the manifest that target_file is up to date'''
+        if self.manifest is not None and not self.cmd_line.args.get('dry_run'):
+            self.manifest.put(self.mirror_key, os.path.abspath(source_image),
+                st, os.path.abspath(target_file))
+
+    def _compress_current(self, root, curr_file, mirrored=None):
+        '''Bring the mirror file of curr_file up to date, mirrored is its
+        manifest entry'''
         postfix = '--%sx.jpg' % self.cmd_line.args.get('compressed_dimension')
-        sliced_root = root[len(self.cmd_line.args.get('organized_dir'))+1:]
+        # files may be given as absolute paths under a relative organized_dir
+        sliced_root = os.path.relpath(root,
+            self.cmd_line.args.get('organized_dir') or os.curdir)
+        if sliced_root == os.curdir:
+            sliced_root = ''
         target_path = join(self.compressed_mirror, sliced_root)
         target_file = join(target_path, curr_file[:-4] + postfix)
         source_image = join(root, curr_file)
@@ -405,39 +996,225 @@ class CompressedMirror(object):
         #log.debug(('target_path', target_path))
         #log.debug(('curr_file', curr_file))
         #log.debug(('target_file', target_file))
-        self._setup_path(target_path)
-        if exists(target_file):
-            if self.cmd_line.args.get('overwrite'):
-                log.debug('Overwriting: %s'  % target_file)
-                self._write_file(source_image, target_file)
-            else:
+        st = os.stat(source_image)
+        target = os.path.abspath(target_file)
+        self.targets.add(target)
+        overwrite = self.cmd_line.args.get('overwrite')
+        if mirrored is not None:
+            if mirrored == (st.st_size, st.st_mtime, target) and not overwrite:
+                log.debug('Up to date: %s' % target_file)
+                return
+            if mirrored[2] != target:
+                self.replaced.append(mirrored[2])
+            log.debug('Refreshing: %s' % target_file)
+        elif exists(target_file):
+            if not overwrite:
                 log.debug('Not overwriting: %s' % target_file)
+                self._record(source_image, st, target_file)
+                return
+            log.debug('Overwriting: %s'  % target_file)
         else:
             log.debug('Writing: %s' % target_file)
-            self._write_file(source_image, target_file)
+        self._write_file(source_image, target_file, st)
         #log.debug(('source_image', source_image))
 
-    def _write_file(self, source_image, target_file):
+    def _preview(self, source_image):
+        '''(offset, length) of the JPEG preview to mirror a raw file from,
+        None for other images'''
+        if not source_image.lower().endswith(RAW_EXTENSIONS):
+            return None
+        preview = read_exif(source_image, PREVIEW_TAGS,
+            self.cache).get('JPEGPreview')
+        if not preview:
+            raise Exception('No JPEG preview in %s' % source_image)
+        # raw files are TIFF based, the preview offset is from file start
+        return tuple(preview)
+
+    def _write_file(self, source_image, target_file, st):
         if self.cmd_line.args.get('dry_run'):
             return
+        self._setup_path(dirname(target_file))
         try:
-            source_img = Image.open(source_image)
-            target_img = source_img.copy()
-            target_img.thumbnail(self.size, Image.ANTIALIAS)
-            target_img.save(target_file)
+            job = (source_image, self._preview(source_image), target_file,
+                self.size)
         except Exception as ex:
             log.error(('error', target_file, ex))
+            return
+        if self.pool is None:
+            self._report(source_image, st, write_compressed(job))
+        else:
+            self._drain(self.max_pending - 1)
+            self.pending.append((source_image, st,
+                self.pool.apply_async(write_compressed, (job,))))
+
+    def _drain(self, limit):
+        '''Report finished jobs, oldest first, until at most limit are
+        pending'''
+        while len(self.pending) > limit:
+            source_image, st, result = self.pending.popleft()
+            self._report(source_image, st, result.get())
+
+    def _report(self, source_image, st, result):
+        target_file, ex, seconds = result
+        if ex is not None:
+            stats.error('thumbnail')
+            log.error(('error', target_file, ex))
+        else:
+            stats.observe('thumbnail', seconds, st.st_size, source_image,
+                self._model(st))
+            self._record(source_image, st, target_file)
+
+    def _model(self, st):
+        '''Camera model of the file with stat st if cached, for the profile
+        report'''
+        if stats.profile_dir is None or self.cache is None:
+            return None
+        return (self.cache.get(st, ()) or {}).get('Image Model')
+
+
+def query(argv):
+    '''Answer questions about the organized library from its catalog'''
+
+    parser = argparse.ArgumentParser(prog='pyImageOrg.py query',
+        description='Query the catalog of organized images.')
+    parser.add_argument('--from', dest='start', metavar='DATE',
+        help='Taken on or after DATE (YYYY-MM-DD[ HH:MM:SS])')
+    parser.add_argument('--to', dest='end', metavar='DATE',
+        help='Taken on or before DATE (YYYY-MM-DD[ HH:MM:SS])')
+    parser.add_argument('--make', help='Camera make, e.g. NIKON CORPORATION')
+    parser.add_argument('--model', help='Camera model, e.g. NIKON D90')
+    parser.add_argument('--db', '--cache', action='store', dest='db',
+        help='Catalog file (default: ORGANIZED_DIR/%s)' % CACHE_FILE)
+    parser.add_argument('-z', '--organized-dir', default='',
+        help='Organized dir holding the catalog')
+    args = parser.parse_args(argv)
+    init_logging(level='warning')
+
+    path = args.db or join(args.organized_dir, CACHE_FILE)
+    if not exists(path):
+        print('No catalog at %s' % path)
+        sys.exit(1)
+    db = catalog.Database(path)
+    try:
+        for row in catalog.Catalog(db).find(args.start, args.end,
+            args.make, args.model):
+            print '\t'.join(str(row[column] or '') for column in
+                ('taken', 'make', 'model', 'shutter_count', 'path'))
+    finally:
+        db.close()
+
+
+def report_dupes(argv):
+    '''List groups of identical images in the organized library and the
+    source folders'''
+
+    parser = argparse.ArgumentParser(prog='pyImageOrg.py dupes',
+        description='Find identical images.')
+    parser.add_argument('-z', '--organized-dir', default='',
+        help='Organized dir to search, and to keep hashes in')
+    parser.add_argument('--db', '--cache', action='store', dest='db',
+        help='Metadata cache file (default: ORGANIZED_DIR/%s)' % CACHE_FILE)
+    parser.add_argument('--no-cache', action='store_true',
+        help='Neither reuse nor keep hashes')
+    parser.add_argument('source_folder', nargs='*',
+        help='More folders to search, e.g. incoming files')
+    args = parser.parse_args(argv)
+    init_logging(level='warning')
+
+    folders = [folder for folder in [args.organized_dir] + args.source_folder
+        if folder]
+    if not folders:
+        parser.error('nothing to search')
+    db = cache = None
+    if not args.no_cache and (args.db or args.organized_dir):
+        db = open_database(args.db, args.organized_dir, dry_run=True)
+        cache = db and catalog.MetadataCache(db)
+    try:
+        paths = (join(root, name)
+            for folder in folders for root, name in walk_images(folder))
+        for group in dupes.find_duplicates(paths, cache):
+            print '\n'.join(group) + '\n'
+    finally:
+        if db is not None:
+            db.close()
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def open_watcher(cmd_line):
+    '''Watcher of source_folder, to start before the first scan so nothing
+    arriving during it is missed'''
+    import watch
+    source_folder = cmd_line.args.get('source_folder')
+    watcher = watch.watcher(source_folder,
+        lambda name: not IGNORE_MATCH(name) and VALID_MATCH(name),
+        lambda: (join(root, name) for root, name in walk_images(source_folder)),
+        cmd_line.args.get('settle'), cmd_line.args.get('poll'))
+    log.info('Watching %s with %s' % (source_folder,
+        watcher.__class__.__name__))
+    return watcher
+
+
+def watch_source(cmd_line, watcher, db, cache, library, manifest):
+    '''Organize and mirror files as watcher finds them done arriving in
+    source_folder, until interrupted'''
+    # stop on kill as on Ctrl-C, an interrupted batch is left to --resume
+    signal.signal(signal.SIGTERM, _interrupt)
+    try:
+        for files in watcher.batches():
+            log.debug('Ready: %s' % files)
+            process = ProcessFiles(cmd_line, cache, library, files)
+            if cmd_line.args.get('compressed_mirror') and process.moved:
+                CompressedMirror(cmd_line, cache, manifest, process.moved)
+            if db is not None:
+                db.commit()
+            if cmd_line.args.get('metrics_file'):
+                stats.write_prometheus(cmd_line.args.get('metrics_file'))
+    except KeyboardInterrupt:
+        log.info('Stopped watching')
 
 
 def main():
     '''Run everything'''
 
+    if sys.argv[1:2] == ['query']:
+        return query(sys.argv[2:])
+    if sys.argv[1:2] == ['dupes']:
+        return report_dupes(sys.argv[2:])
     cmd_line = CommandLineParameters()
-    if not cmd_line.skip_processfiles:
-        ProcessFiles(cmd_line)
-    if cmd_line.args.get('compressed_mirror'):
-        print 'Compress Mirror'
-        CompressedMirror(cmd_line)
+    if cmd_line.args.get('profile'):
+        stats.enable_profiling(cmd_line.args.get('profile'))
+    db = open_database(cmd_line.args.get('db'),
+        cmd_line.args.get('organized_dir'), cmd_line.args.get('dry_run'))
+    cache = library = manifest = None
+    if db is not None:
+        if not cmd_line.args.get('no_cache'):
+            cache = catalog.MetadataCache(db)
+        library = catalog.Catalog(db)
+        manifest = catalog.MirrorManifest(db)
+    watcher = None
+    if cmd_line.args.get('watch'):
+        watcher = open_watcher(cmd_line)
+    try:
+        if not cmd_line.skip_processfiles:
+            ProcessFiles(cmd_line, cache, library)
+            if library is not None:
+                library.analyze()
+        if cmd_line.args.get('compressed_mirror'):
+            print 'Compress Mirror'
+            CompressedMirror(cmd_line, cache, manifest)
+        if watcher is not None:
+            watch_source(cmd_line, watcher, db, cache, library, manifest)
+    finally:
+        if db is not None:
+            db.close()
+        if cmd_line.args.get('metrics_file'):
+            stats.write_prometheus(cmd_line.args.get('metrics_file'))
+        if cmd_line.args.get('summary'):
+            stats.write_json(cmd_line.args.get('summary'))
+        stats.write_profile_report()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+
+'''Tests of the SQLite stores, run with python -m unittest discover'''
+
+import os
+import unittest
+
+import catalog
+
+
+class MirrorManifestTest(unittest.TestCase):
+    '''Entries come back as the byte strings they were put with'''
+
+    def setUp(self):
+        self.db = catalog.Database(':memory:')
+        self.manifest = catalog.MirrorManifest(self.db)
+        self.st = os.stat(__file__)
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_non_ascii_paths(self):
+        mirror = os.path.abspath('mirror\xc3\xa9')
+        source = os.path.abspath('org\xe9/2010/05/06/caf\xc3\xa9.jpg')
+        target = os.path.join(mirror, '2010/05/06/caf\xc3\xa9--1600x.jpg')
+        self.manifest.put(mirror, source, self.st, target)
+        entries = self.manifest.entries(mirror)
+        self.assertEqual(entries.keys(), [source])
+        self.assertEqual(type(entries.keys()[0]), str)
+        entry = self.manifest.entry(mirror, source)
+        self.assertEqual(tuple(entry),
+            (self.st.st_size, self.st.st_mtime, target))
+        self.assertEqual(type(entry[2]), str)
+        self.manifest.remove(mirror, source)
+        self.assertEqual(self.manifest.entries(mirror), {})
+
+
+class CatalogTest(unittest.TestCase):
+
+    def test_non_ascii_row(self):
+        db = catalog.Database(':memory:')
+        files = catalog.Catalog(db)
+        files.add(path='/org/caf\xc3\xa9.jpg', original='/src\xe9/a.jpg',
+            taken='2010-05-06 07:08:09', make='NIKON \xe9', model='D90')
+        rows = files.find(make='nikon \xe9')
+        self.assertEqual([row['original'] for row in rows], ['/src\xe9/a.jpg'])
+        db.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+
+'''Tests of the EXIF parser on generated images, run with
+python -m unittest discover'''
+
+import os
+import random
+import struct
+import sys
+import tempfile
+import threading
+import unittest
+from collections import defaultdict
+from StringIO import StringIO
+
+import EXIF
+
+# bytes per value of each TIFF field type
+TYPE_SIZE = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 7: 1}
+TYPE_FORMAT = {1: 'B', 3: 'H', 4: 'L', 7: 'B'}
+
+# the tags a quick parse asks for, as when organizing
+QUICK_TAGS = ('EXIF DateTimeOriginal', 'MakerNote TotalShutterReleases',
+    'Image Make', 'Image Model')
+
+
+def _field(order, kind, values):
+    '''Raw bytes of values of TIFF field type kind'''
+    if kind in (2, 7) and isinstance(values, str):
+        return values
+    if kind == 5:
+        return ''.join(struct.pack(order + 'LL', num, den)
+            for num, den in values)
+    return ''.join(struct.pack(order + TYPE_FORMAT[kind], value)
+        for value in values)
+
+
+def _ifd_size(entries):
+    '''Bytes taken by an IFD and the values that do not fit its entries'''
+    size = 2 + 12 * len(entries) + 4
+    for tag, kind, values in entries:
+        if callable(values):
+            # offsets take the same room whatever they are
+            values = values(defaultdict(int))
+        length = len(_field('>', kind, values))
+        if length > 4:
+            size += length + (length & 1)
+    return size
+
+
+def make_tiff(order, ifds, blob=''):
+    '''TIFF stream of ifds, lists of (tag, type, values) chained as IFD0,
+    IFD1; values may be a function of the {name: offset} of the IFDs and
+    of 'blob', the bytes placed after them. ifds is a list of (name,
+    entries, next name or None)'''
+    offsets, offset = {}, 8
+    for name, entries, chained in ifds:
+        offsets[name] = offset
+        offset += _ifd_size(entries)
+    offsets['blob'] = offset
+    out = [('II*\x00' if order == '<' else 'MM\x00*') +
+        struct.pack(order + 'L', 8)]
+    for name, entries, chained in ifds:
+        entries = sorted(entries)
+        extra, extra_at = [], offsets[name] + 2 + 12 * len(entries) + 4
+        out.append(struct.pack(order + 'H', len(entries)))
+        for tag, kind, values in entries:
+            if callable(values):
+                values = values(offsets)
+            raw = _field(order, kind, values)
+            out.append(struct.pack(order + 'HHL', tag, kind,
+                len(raw) // TYPE_SIZE[kind]))
+            if len(raw) <= 4:
+                out.append(raw.ljust(4, '\0'))
+            else:
+                out.append(struct.pack(order + 'L', extra_at))
+                raw += '\0' * (len(raw) & 1)
+                extra.append(raw)
+                extra_at += len(raw)
+        out.append(struct.pack(order + 'L',
+            offsets[chained] if chained else 0))
+        out.extend(extra)
+    out.append(blob)
+    return ''.join(out)
+
+
+def make_jpeg(order, shutter_count, taken='2010:05:06 07:08:09'):
+    '''A JPEG as a Nikon camera writes it: EXIF with a type 2 MakerNote
+    and a JPEG thumbnail'''
+    note = 'Nikon\0\x02\x10\0\0' + make_tiff(order, [('note', [
+        (0x0001, 7, '0210'),
+        (0x0002, 3, [0, 200]),
+        (0x0004, 2, 'FINE   \0'),
+        (0x0084, 5, [(180, 10), (700, 10), (35, 10), (56, 10)]),
+        (0x00A7, 4, [shutter_count]),
+        (0x0098, 3, range(20)),
+    ], None)])
+    thumbnail = '\xff\xd8' + ''.join(chr(i % 256) for i in range(500)) + \
+        '\xff\xd9'
+    tiff = make_tiff(order, [
+        ('ifd0', [
+            (0x010F, 2, 'NIKON CORPORATION\0'),
+            (0x0110, 2, 'NIKON D90\0'),
+            (0x0112, 3, [1]),
+            (0x011A, 5, [(300, 1)]),
+            (0x8769, 4, lambda offsets: [offsets['exif']]),
+        ], 'ifd1'),
+        ('ifd1', [
+            (0x0103, 3, [6]),
+            (0x0201, 4, lambda offsets: [offsets['blob']]),
+            (0x0202, 4, [len(thumbnail)]),
+        ], None),
+        ('exif', [
+            (0x829A, 5, [(1, 250)]),
+            (0x9003, 2, taken + '\0'),
+            (0x9004, 2, taken + '\0'),
+            (0x9286, 7, 'ASCII\0\0\0generated'),
+            (0x927C, 7, note),
+        ], None),
+    ], thumbnail)
+    app1 = 'Exif\0\0' + tiff
+    return '\xff\xd8\xff\xe1' + struct.pack('>H', len(app1) + 2) + app1 + \
+        '\xff\xd9'
+
+
+def make_raw(dng):
+    '''A raw file keeping its full size JPEG preview in a SubIFD: as a
+    JPEG interchange format like a NEF, or as the single JPEG compressed
+    strip of a reduced resolution subfile like a DNG'''
+    preview = '\xff\xd8' + 'preview' * 300 + '\xff\xd9'
+    if dng:
+        sub = [
+            (0x00FE, 4, [1]),
+            (0x0103, 3, [7]),
+            (0x0111, 4, lambda offsets: [offsets['blob']]),
+            (0x0117, 4, [len(preview)]),
+        ]
+    else:
+        sub = [
+            (0x00FE, 4, [1]),
+            (0x0103, 3, [6]),
+            (0x0201, 4, lambda offsets: [offsets['blob']]),
+            (0x0202, 4, [len(preview)]),
+        ]
+    raw = [
+        (0x00FE, 4, [0]),
+        (0x0103, 3, [34713 if not dng else 7]),
+        (0x0100, 4, [4352]),
+    ]
+    return make_tiff('>' if not dng else '<', [
+        ('ifd0', [
+            (0x00FE, 4, [1]),
+            (0x010F, 2, 'NIKON CORPORATION\0' if not dng else 'Adobe\0'),
+            (0x014A, 4, lambda offsets: [offsets['sub'], offsets['raw']]),
+        ], None),
+        ('sub', sub, None),
+        ('raw', raw, None),
+    ], preview), preview
+
+
+# bytes of the MakerNote of the generated raw file
+NOTE_SIZE = 256 * 1024
+
+
+def make_nef(note_size=NOTE_SIZE):
+    '''A NEF whose Nikon MakerNote is note_size bytes, most of it a single
+    undefined tag as cameras keep their calibration data'''
+    note = 'Nikon\0\x02\x10\0\0' + make_tiff('>', [('note', [
+        (0x0001, 7, '0210'),
+        (0x0004, 2, 'FINE   \0'),
+        (0x00A7, 4, [12345]),
+        (0x0098, 3, range(200)),
+        (0x0097, 7, ''.join(chr(i % 251) for i in range(note_size))),
+    ], None)])
+    return make_tiff('>', [
+        ('ifd0', [
+            (0x010F, 2, 'NIKON CORPORATION\0'),
+            (0x0110, 2, 'NIKON D90\0'),
+            (0x011A, 5, [(300, 1)]),
+            (0x8769, 4, lambda offsets: [offsets['exif']]),
+        ], None),
+        ('exif', [
+            (0x829A, 5, [(1, 250)]),
+            (0x9003, 2, '2010:05:06 07:08:09\0'),
+            (0x927C, 7, note),
+        ], None),
+    ])
+
+
+def snapshot(data, **options):
+    '''Everything process_file finds in data, comparable across calls'''
+    tags = EXIF.process_file(StringIO(data), **options)
+    result = {}
+    for name, tag in tags.items():
+        if hasattr(tag, 'printable'):
+            result[name] = (tag.printable, repr(tag.values))
+        else:
+            result[name] = repr(tag)
+    return result
+
+
+class ProcessFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.images = [make_jpeg('>', 12345), make_jpeg('<', 678,
+            '2011:12:13 14:15:16')]
+
+    def test_generated_image(self):
+        tags = EXIF.process_file(StringIO(self.images[0]))
+        self.assertEqual(tags['Image Make'].printable, 'NIKON CORPORATION')
+        self.assertEqual(tags['EXIF DateTimeOriginal'].printable,
+            '2010:05:06 07:08:09')
+        self.assertEqual(list(tags['MakerNote TotalShutterReleases'].values),
+            [12345])
+        self.assertTrue('MakerNote Quality' in tags)
+        thumbnail = str(tags['JPEGThumbnail'])
+        self.assertEqual((thumbnail[:2], thumbnail[-2:], len(thumbnail)),
+            ('\xff\xd8', '\xff\xd9', 504))
+        quick = EXIF.process_file(StringIO(self.images[1]), tags=QUICK_TAGS)
+        self.assertEqual(list(quick['MakerNote TotalShutterReleases'].values),
+            [678])
+        plain = EXIF.process_file(StringIO(self.images[0]), details=False)
+        self.assertFalse('MakerNote Quality' in plain)
+
+    def test_raw_preview(self):
+        '''The preview of NEF and DNG layouts is found, whole or quick'''
+        for dng in (False, True):
+            data, preview = make_raw(dng)
+            for options in (dict(), dict(tags=('JPEGPreview',))):
+                tags = EXIF.process_file(StringIO(data), **options)
+                self.assertTrue('JPEGPreview' in tags, (dng, options))
+                self.assertEqual(str(tags['JPEGPreview']), preview)
+
+    def test_structs_do_not_grow(self):
+        '''Directories and values of any length decode with the same few
+        compiled structs'''
+        formats = set(EXIF._structs)
+        for data in self.images + [make_raw(True)[0], make_nef(1000)]:
+            EXIF.process_file(StringIO(data))
+        self.assertEqual(set(EXIF._structs), formats)
+
+    def test_large_maker_note(self):
+        '''A large MakerNote decodes into an array, not a list of ints'''
+        tags = EXIF.process_file(StringIO(make_nef()))
+        note = tags['EXIF MakerNote']
+        self.assertTrue(len(note.values) > NOTE_SIZE)
+        self.assertTrue(sys.getsizeof(note.values) < 2 * len(note.values))
+        self.assertEqual(list(tags['MakerNote TotalShutterReleases'].values),
+            [12345])
+
+    @unittest.skipUnless(os.path.isdir('/proc/self/fd'), 'needs /proc')
+    def test_results_do_not_hold_the_file(self):
+        '''Tags kept after parsing a mapped raw file hold neither its
+        descriptor nor its mapping, the preview is read again by name'''
+        data, preview = make_raw(False)
+        handle, path = tempfile.mkstemp(suffix='.nef')
+        try:
+            os.write(handle, data)
+            os.close(handle)
+            before = len(os.listdir('/proc/self/fd'))
+            kept = []
+            for count in range(20):
+                f = open(path, 'rb')
+                kept.append(EXIF.process_file(f))
+                f.close()
+                for tag in kept[-1].values():
+                    getattr(tag, 'values', None)
+            self.assertEqual(len(os.listdir('/proc/self/fd')), before)
+            self.assertEqual(str(kept[0]['JPEGPreview']), preview)
+            self.assertEqual(kept[-1]['Image Make'].printable,
+                'NIKON CORPORATION')
+        finally:
+            os.remove(path)
+
+    def test_threads_see_the_same_tags(self):
+        '''Quick and detailed parses mixed across threads give what each
+        gives alone'''
+        modes = (dict(), dict(details=False), dict(tags=QUICK_TAGS))
+        expected = {}
+        for image in range(len(self.images)):
+            for mode in range(len(modes)):
+                expected[image, mode] = snapshot(self.images[image],
+                    **modes[mode])
+        self.assertNotEqual(expected[0, 0], expected[0, 1])
+        mismatches = []
+
+        def parse(seed):
+            rand = random.Random(seed)
+            for count in range(60):
+                key = (rand.randrange(len(self.images)),
+                    rand.randrange(len(modes)))
+                if snapshot(self.images[key[0]], **modes[key[1]]) != \
+                        expected[key]:
+                    mismatches.append(key)
+
+        threads = [threading.Thread(target=parse, args=(seed,))
+            for seed in range(12)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(mismatches, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
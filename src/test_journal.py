@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+
+'''Tests of the organize journal, run with python -m unittest discover'''
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import journal
+
+
+class JournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'journal')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_pending_gives_back_the_bytes(self):
+        '''Paths in any encoding resume as the bytes they were started with'''
+        operations = [
+            dict(action='move', source='/src/caf\xc3\xa9.jpg',
+                target='/org/a.jpg', catalog=dict(make='NIKON \xe9',
+                original='/src/caf\xc3\xa9.jpg', shutter_count=3)),
+            dict(action='delete', source='/src\xe9/b.jpg',
+                target='/org/a.jpg', catalog=None),
+            dict(action='move', source='/src/c.jpg', target='/org/c.jpg',
+                catalog=None),
+        ]
+        jour = journal.Journal(self.path)
+        jour.start([dict(operation) for operation in operations])
+        jour.done({'id': 1})
+        jour.close()
+        pending = journal.Journal(self.path).pending()
+        self.assertEqual([operation['id'] for operation in pending], [0, 2])
+        for operation, expected in zip(pending, (operations[0], operations[2])):
+            self.assertEqual(operation, dict(expected, id=operation['id']))
+        self.assertEqual(type(pending[0]['source']), str)
+
+    def test_failed_start_leaves_no_journal(self):
+        jour = journal.Journal(self.path)
+        self.assertRaises(TypeError, jour.start,
+            [dict(action='move', source=object())])
+        self.assertFalse(os.path.exists(self.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+'''Tests of pyImageOrg, run with python -m unittest discover'''
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import pyImageOrg
+from pyImageOrg import ImageFile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+class ImportTest(unittest.TestCase):
+
+    def test_import_stays_light(self):
+        '''PIL, multiprocessing, the watcher and the maker note tables are
+        only loaded once needed'''
+        # a fresh interpreter, whatever this one has imported already
+        output = subprocess.check_output([sys.executable, '-c',
+            'import sys\n'
+            'import pyImageOrg, EXIF\n'
+            'print sorted(name for name in ("Image", "multiprocessing", '
+            '"watch") if name in sys.modules)\n'
+            'print EXIF._makernote_tags\n'], cwd=HERE)
+        self.assertEqual(output.split('\n')[:2], ['[]', '{}'])
+
+
+class WriteCompressedTest(unittest.TestCase):
+
+    def test_missing_pil_is_the_job_error(self):
+        '''Without PIL every job still gives (target_file, exception,
+        seconds), the mirror goes on'''
+        saved = sys.modules.get('Image')
+        # None in sys.modules makes the import fail
+        sys.modules['Image'] = None
+        try:
+            target_file, error, seconds = pyImageOrg.write_compressed(
+                ('source.jpg', None, 'target.jpg', (1600, 1600)))
+        finally:
+            if saved is None:
+                del sys.modules['Image']
+            else:
+                sys.modules['Image'] = saved
+        self.assertEqual(target_file, 'target.jpg')
+        self.assertTrue(isinstance(error, ImportError))
+        self.assertTrue(seconds >= 0)
+
+
+class Options(object):
+    '''Stands in for CommandLineParameters'''
+
+    def __init__(self, **args):
+        self.args = args
+
+
+def tags(taken='2010:05:06 07:08:09', shutter_count=12345):
+    '''Fields read_exif returns for a Nikon image'''
+    return {'EXIF DateTimeOriginal': taken,
+        'MakerNote TotalShutterReleases': shutter_count and [shutter_count],
+        'Image Make': 'NIKON CORPORATION', 'Image Model': 'NIKON D90'}
+
+
+class StagesTest(unittest.TestCase):
+    '''_name and _plan on hand-built records, without walking or parsing'''
+
+    def setUp(self):
+        pyImageOrg.init_logging(level='critical')
+        self.tmp = tempfile.mkdtemp()
+        self.org = os.path.join(self.tmp, 'org')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def stages(self, **args):
+        '''ProcessFiles ready to run its stages, with args as options'''
+        args = dict(dict(organized_dir=self.org, queue_errors=True), **args)
+        process = pyImageOrg.ProcessFiles.__new__(pyImageOrg.ProcessFiles)
+        process.cmd_line = Options(**args)
+        process.cache = process.catalog = None
+        process.listings = {}
+        process.planned = {}
+        return process
+
+    def source(self, name, data='image'):
+        path = os.path.join(self.tmp, name)
+        sfile = open(path, 'wb')
+        sfile.write(data)
+        sfile.close()
+        return path
+
+    def record(self, name, exif=None, error=None, data='image'):
+        '''Record of a new source file name, as _parse gives it'''
+        return ImageFile(self.source(name, data), exif, None, None, error)
+
+    def test_name(self):
+        error = IOError('unreadable')
+        named = list(self.stages()._name([
+            self.record('a.JPG', tags()),
+            self.record('b.nef', tags(shutter_count=None)),
+            self.record('c.jpg', tags(taken=None)),
+            self.record('d.jpg', error=error),
+        ]))
+        self.assertEqual([record.target for record in named], [
+            os.path.join(self.org, '2010/05/06/20100506-070809-12345.JPG'),
+            os.path.join(self.org, '2010/05/06/20100506-070809.nef'),
+            None, None])
+        self.assertEqual(named[0].fields['YYYY'], '2010')
+        self.assertEqual(str(named[2].error), 'Skip')
+        self.assertTrue(named[3].error is error)
+
+    def test_name_lower_case_extension(self):
+        named = list(self.stages(lower_case_ext=True)._name(
+            [self.record('a.JPG', tags())]))
+        self.assertTrue(named[0].target.endswith('-12345.jpg'))
+
+    def test_plan(self):
+        process = self.stages()
+        in_place = os.path.join(self.org, '2011/01/01/20110101-070809-1.jpg')
+        os.makedirs(os.path.dirname(in_place))
+        shutil.copy(self.source('x.jpg'), in_place)
+        records = list(process._name([
+            self.record('a.jpg', tags()),
+            # same second and shutter count, a collision
+            self.record('b.jpg', tags()),
+            self.record('c.jpg', tags(taken=None)),
+            ImageFile(in_place, tags('2011:01:01 07:08:09', 1),
+                None, None, None),
+        ]))
+        operations = list(process._plan(records))
+        self.assertEqual([(operation['action'], operation.get('reason'))
+            for operation in operations], [('move', None),
+            ('skip', 'exists'), ('skip', 'Skip'), ('skip', 'in place')])
+        self.assertEqual(operations[0]['source'], records[0].source)
+        self.assertEqual(operations[0]['target'], records[0].target)
+        self.assertEqual(process.planned,
+            {records[0].target: records[0].source})
+
+    def test_plan_duplicates(self):
+        process = self.stages(overwrite=True, delete_dupes=True)
+        operations = list(process._plan(process._name([
+            self.record('a.jpg', tags()),
+            self.record('b.jpg', tags()),
+            self.record('c.jpg', tags(), data='other image'),
+        ])))
+        self.assertEqual([(operation['action'], operation.get('reason'))
+            for operation in operations], [('move', None),
+            ('delete', 'duplicate'), ('skip', 'differs')])
+
+
+if __name__ == '__main__':
+    unittest.main()
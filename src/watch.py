@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+
+'''Wait for image files to be completely written into a folder'''
+
+import os
+import time
+import select
+import struct
+import ctypes
+import ctypes.util
+
+# inotify(7) event masks
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF | \
+    IN_MOVE_SELF | IN_ONLYDIR
+EVENT = struct.Struct('iIII')
+
+# seconds without a new close-write before a file is handed out
+DEBOUNCE = 0.2
+
+
+class Watcher(object):
+    '''Base of the watchers: files whose size and mtime stopped changing
+    for settle seconds are ready'''
+
+    def __init__(self, top, wanted, scan, settle):
+        self.top = top
+        # wanted(name): whether a file name is of interest
+        self.wanted = wanted
+        # scan(): paths of all the files of interest under top
+        self.scan = scan
+        self.settle = settle
+        # path: (size, mtime, since when unchanged)
+        self.settling = {}
+
+    def _settle(self, path):
+        '''Hand path out once it stops changing'''
+        self.settling.setdefault(path, (None, None, time.time()))
+
+    def _settled(self, now):
+        '''Settling paths that have been stable long enough'''
+        ready = []
+        for path, (size, mtime, since) in self.settling.items():
+            try:
+                st = os.stat(path)
+            except OSError:
+                del self.settling[path]
+                continue
+            if (st.st_size, st.st_mtime) != (size, mtime):
+                self.settling[path] = (st.st_size, st.st_mtime, now)
+            elif now - since >= self.settle:
+                del self.settling[path]
+                ready.append(path)
+        return ready
+
+    def batches(self):
+        '''Lists of paths ready to process, forever'''
+        while True:
+            ready = self.poll()
+            if ready:
+                yield ready
+
+    def poll(self):
+        '''Wait a little, return the paths that became ready'''
+        raise NotImplementedError
+
+
+class InotifyWatcher(Watcher):
+    '''Files under top as they are closed after writing or moved in, from
+    Linux inotify through ctypes'''
+
+    def __init__(self, top, wanted, scan, settle):
+        Watcher.__init__(self, top, wanted, scan, settle)
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+            use_errno=True)
+        # AttributeError where there is no inotify
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p,
+            ctypes.c_uint32)
+        self.fd = libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            _raise_errno('inotify_init1')
+        # watch descriptor: dir
+        self.dirs = {}
+        # path: time of its last close-write
+        self.written = {}
+        self._add_tree(top, initial=True)
+
+    def _add_tree(self, top, initial=False):
+        '''Watch top and the dirs under it; files already in a dir that
+        appeared while running may still be written, let them settle'''
+        for root, dirs, files in os.walk(top):
+            wd = self._add_watch(self.fd, root, WATCH_MASK)
+            if wd < 0:
+                _raise_errno('inotify_add_watch', root)
+            self.dirs[wd] = root
+            if not initial:
+                for name in files:
+                    if self.wanted(name):
+                        self._settle(os.path.join(root, name))
+
+    def poll(self):
+        now = time.time()
+        timeout = DEBOUNCE if self.written or self.settling else 1.0
+        if select.select([self.fd], [], [], timeout)[0]:
+            self._read_events()
+            now = time.time()
+        ready = [path for path, when in self.written.items()
+            if now - when >= DEBOUNCE]
+        for path in ready:
+            del self.written[path]
+        # events queued while the first scan ran may be for files it moved
+        return [path for path in ready if os.path.lexists(path)] + \
+            self._settled(now)
+
+    def _read_events(self):
+        data = os.read(self.fd, 65536)
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = data[offset:offset + length].rstrip('\0')
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                # events were lost, look at everything once
+                for path in self.scan():
+                    self._settle(path)
+                continue
+            if mask & IN_IGNORED:
+                self.dirs.pop(wd, None)
+                continue
+            if wd not in self.dirs or not name:
+                continue
+            path = os.path.join(self.dirs[wd], name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self._add_tree(path)
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO) and self.wanted(name):
+                self.written[path] = time.time()
+
+
+class PollingWatcher(Watcher):
+    '''Files under top found by scanning it every interval seconds, ready
+    once unchanged for settle seconds'''
+
+    def __init__(self, top, wanted, scan, settle, interval):
+        Watcher.__init__(self, top, wanted, scan, settle)
+        self.interval = interval
+        self.last_scan = 0
+        # path: (size, mtime) when handed out, not to hand out again
+        self.done = {}
+
+    def poll(self):
+        now = time.time()
+        if now - self.last_scan < self.interval:
+            time.sleep(min(self.interval - (now - self.last_scan),
+                self.settle if self.settling else self.interval))
+        now = time.time()
+        if now - self.last_scan >= self.interval:
+            self.last_scan = now
+            seen = set()
+            for path in self.scan():
+                seen.add(path)
+                if path in self.done:
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    if self.done[path] == (st.st_size, st.st_mtime):
+                        continue
+                    del self.done[path]
+                self._settle(path)
+            for path in set(self.done) - seen:
+                del self.done[path]
+        ready = self._settled(now)
+        for path in ready:
+            try:
+                st = os.stat(path)
+                self.done[path] = (st.st_size, st.st_mtime)
+            except OSError:
+                pass
+        return ready
+
+
+def watcher(top, wanted, scan, settle, interval):
+    '''An InotifyWatcher on top where inotify works, else a PollingWatcher'''
+    try:
+        return InotifyWatcher(top, wanted, scan, settle)
+    except (AttributeError, OSError):
+        return PollingWatcher(top, wanted, scan, settle, interval)
+
+
+def _raise_errno(call, path=None):
+    number = ctypes.get_errno()
+    if path is None:
+        raise OSError(number, '%s: %s' % (call, os.strerror(number)))
+    raise OSError(number, '%s: %s' % (call, os.strerror(number)), path)